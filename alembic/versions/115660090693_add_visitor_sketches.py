@@ -0,0 +1,42 @@
+"""Add visitor_sketches
+
+Revision ID: 115660090693
+Revises: 1ee47fddf3b2
+Create Date: 2026-10-19 09:05:12.418233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '115660090693'
+down_revision: Union[str, None] = '1ee47fddf3b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'visitor_sketches',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('blogger_id', sa.Integer(), nullable=True),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('registers', sa.LargeBinary(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['blogger_id'], ['bloggers.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('product_id', 'blogger_id', 'day', name='uq_visitor_sketches_product_blogger_day')
+    )
+    op.create_index(op.f('ix_visitor_sketches_id'), 'visitor_sketches', ['id'], unique=False)
+    op.create_index(op.f('ix_visitor_sketches_product_id'), 'visitor_sketches', ['product_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_visitor_sketches_product_id'), table_name='visitor_sketches')
+    op.drop_index(op.f('ix_visitor_sketches_id'), table_name='visitor_sketches')
+    op.drop_table('visitor_sketches')
@@ -0,0 +1,35 @@
+"""Add job_checkpoints and index orders.updated_at
+
+Revision ID: 4b7e19d3c6a2
+Revises: a3f9d2c81e57
+Create Date: 2026-10-19 15:02:41.208734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e19d3c6a2'
+down_revision: Union[str, None] = 'a3f9d2c81e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_checkpoints',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('checkpoint', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    # Created on every orders partition
+    op.create_index(op.f('ix_orders_updated_at'), 'orders', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_orders_updated_at'), table_name='orders')
+    op.drop_table('job_checkpoints')
@@ -0,0 +1,41 @@
+"""Add click_events partitioned by day
+
+Revision ID: 5b0e2c7d9a41
+Revises: 115660090693
+Create Date: 2026-10-19 09:32:47.106512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b0e2c7d9a41'
+down_revision: Union[str, None] = '115660090693'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Daily partitions are created on demand by the click log writer
+    op.create_table(
+        'click_events',
+        sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column('occurred_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('blogger_id', sa.Integer(), nullable=True),
+        sa.Column('link_code', sa.String(), nullable=True),
+        sa.Column('referrer', sa.String(), nullable=True),
+        sa.Column('user_agent_hash', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id', 'occurred_at'),
+        postgresql_partition_by='RANGE (occurred_at)'
+    )
+    op.create_index(op.f('ix_click_events_product_id'), 'click_events', ['product_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_click_events_product_id'), table_name='click_events')
+    op.drop_table('click_events')
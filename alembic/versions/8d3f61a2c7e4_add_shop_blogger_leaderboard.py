@@ -0,0 +1,57 @@
+"""Add shop_blogger_leaderboard
+
+Revision ID: 8d3f61a2c7e4
+Revises: 5b0e2c7d9a41
+Create Date: 2026-10-19 10:14:03.551872
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f61a2c7e4'
+down_revision: Union[str, None] = '5b0e2c7d9a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'shop_blogger_leaderboard',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('shop_id', sa.Integer(), nullable=False),
+        sa.Column('blogger_id', sa.Integer(), nullable=False),
+        sa.Column('visit_count', sa.Integer(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('items_sold', sa.Integer(), nullable=False),
+        sa.Column('money_earned', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['blogger_id'], ['bloggers.id'], ),
+        sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('shop_id', 'blogger_id', name='uq_shop_blogger_leaderboard_shop_blogger')
+    )
+    op.create_index(op.f('ix_shop_blogger_leaderboard_id'), 'shop_blogger_leaderboard', ['id'], unique=False)
+    op.execute("CREATE INDEX ix_shop_blogger_leaderboard_revenue ON shop_blogger_leaderboard (shop_id, money_earned DESC)")
+    op.execute("CREATE INDEX ix_shop_blogger_leaderboard_orders ON shop_blogger_leaderboard (shop_id, order_count DESC)")
+    op.execute(
+        "CREATE INDEX ix_shop_blogger_leaderboard_conversion ON shop_blogger_leaderboard "
+        "(shop_id, (CAST(order_count AS FLOAT) / CAST(NULLIF(visit_count, 0) AS FLOAT)) DESC NULLS LAST)"
+    )
+    # Seed from existing analytics
+    op.execute("""
+        INSERT INTO shop_blogger_leaderboard (shop_id, blogger_id, visit_count, order_count, items_sold, money_earned)
+        SELECT products.shop_id, analytics.blogger_id,
+               COALESCE(SUM(analytics.visit_count), 0), COALESCE(SUM(analytics.order_count), 0),
+               COALESCE(SUM(analytics.items_sold), 0), COALESCE(SUM(analytics.money_earned), 0)
+        FROM analytics JOIN products ON analytics.product_id = products.id
+        WHERE analytics.blogger_id IS NOT NULL AND products.shop_id IS NOT NULL
+        GROUP BY products.shop_id, analytics.blogger_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('shop_blogger_leaderboard')
@@ -0,0 +1,59 @@
+"""Add blogger_earnings
+
+Revision ID: 9c2d5e8a4f17
+Revises: 4b7e19d3c6a2
+Create Date: 2026-10-19 16:21:09.734152
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2d5e8a4f17'
+down_revision: Union[str, None] = '4b7e19d3c6a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'blogger_earnings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('blogger_id', sa.Integer(), nullable=False),
+        sa.Column('shop_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('items_sold', sa.Integer(), nullable=False),
+        sa.Column('money_earned', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['blogger_id'], ['bloggers.id'], ),
+        sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('blogger_id', 'shop_id', 'month', name='uq_blogger_earnings_blogger_shop_month')
+    )
+    op.create_index('ix_blogger_earnings_month', 'blogger_earnings', ['month', 'blogger_id', 'shop_id'], unique=False)
+    # Seed from processed orders. Orders whose apply_processed_order task is still in
+    # deferred_tasks are left to that task; stop the workers before upgrading so
+    # none is waiting in an in-memory queue.
+    op.execute("""
+        INSERT INTO blogger_earnings (blogger_id, shop_id, month, order_count, items_sold, money_earned)
+        SELECT orders.blogger_id, products.shop_id,
+               CAST(date_trunc('month', timezone('UTC', orders.created_at)) AS DATE),
+               COUNT(*), COALESCE(SUM(orders.quantity), 0),
+               COALESCE(SUM(orders.quantity * orders.price_per_item), 0)
+        FROM orders JOIN products ON orders.product_id = products.id
+        WHERE orders.status = 'PROCESSED' AND orders.blogger_id IS NOT NULL AND products.shop_id IS NOT NULL
+          AND orders.id NOT IN (
+              SELECT CAST(CAST(payload AS json) ->> 'order_id' AS INTEGER) FROM deferred_tasks
+              WHERE name = 'apply_processed_order' AND status = 'pending'
+          )
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_blogger_earnings_month', table_name='blogger_earnings')
+    op.drop_table('blogger_earnings')
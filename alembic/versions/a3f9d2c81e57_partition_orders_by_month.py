@@ -0,0 +1,100 @@
+"""Partition orders by month of created_at
+
+Revision ID: a3f9d2c81e57
+Revises: e7a2b5c90f13
+Create Date: 2026-10-19 14:06:12.483920
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f9d2c81e57'
+down_revision: Union[str, None] = 'e7a2b5c90f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+COLUMNS = 'id, product_id, blogger_id, quantity, price_per_item, client_phone, status, created_at, updated_at'
+
+
+def _rename_to_old() -> None:
+    op.rename_table('orders', 'orders_old')
+    op.execute('ALTER INDEX ix_orders_id RENAME TO ix_orders_old_id')
+    for constraint in ('pkey', 'product_id_fkey', 'blogger_id_fkey'):
+        op.execute(f'ALTER TABLE orders_old RENAME CONSTRAINT orders_{constraint} TO orders_old_{constraint}')
+
+
+def _create_orders(primary_key: sa.PrimaryKeyConstraint, created_at_nullable: bool, **kwargs) -> None:
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('orders_id_seq'::regclass)"), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('blogger_id', sa.Integer(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.Column('price_per_item', sa.Float(), nullable=True),
+        sa.Column('client_phone', sa.String(), nullable=True),
+        sa.Column('status', postgresql.ENUM(name='orderstatus', create_type=False), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=created_at_nullable),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['blogger_id'], ['bloggers.id'], name='orders_blogger_id_fkey'),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], name='orders_product_id_fkey'),
+        primary_key,
+        **kwargs
+    )
+    op.create_index(op.f('ix_orders_id'), 'orders', ['id'], unique=False)
+    # Keep the existing sequence so new ids continue where the old table stopped
+    op.execute('ALTER SEQUENCE orders_id_seq OWNED BY orders.id')
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    _rename_to_old()
+    _create_orders(
+        sa.PrimaryKeyConstraint('id', 'created_at', name='orders_pkey'),
+        created_at_nullable=False,
+        postgresql_partition_by='RANGE (created_at)'
+    )
+
+    # One partition per month from the oldest order through a few months ahead;
+    # app.order_partitions keeps creating them from here on
+    bind = op.get_bind()
+    oldest, today = bind.execute(sa.text(
+        "SELECT min(coalesce(created_at, updated_at, now()))::date, now()::date FROM orders_old"
+    )).one()
+    current = date(today.year, today.month, 1)
+    month = date(oldest.year, oldest.month, 1) if oldest else current
+    while month <= _add_months(current, MONTHS_AHEAD):
+        next_month = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE orders_{month:%Y%m} PARTITION OF orders "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{next_month.isoformat()} 00:00:00+00')"
+        )
+        month = next_month
+    op.execute('CREATE TABLE orders_default PARTITION OF orders DEFAULT')
+
+    op.execute(
+        f"INSERT INTO orders ({COLUMNS}) "
+        f"SELECT {COLUMNS.replace('created_at', 'coalesce(created_at, updated_at, now())')} FROM orders_old"
+    )
+    op.drop_table('orders_old')
+
+
+def downgrade() -> None:
+    # Partitions that were archived and detached are not brought back
+    _rename_to_old()
+    _create_orders(
+        sa.PrimaryKeyConstraint('id', name='orders_pkey'),
+        created_at_nullable=True
+    )
+    op.execute(f"INSERT INTO orders ({COLUMNS}) SELECT {COLUMNS} FROM orders_old")
+    op.drop_table('orders_old')
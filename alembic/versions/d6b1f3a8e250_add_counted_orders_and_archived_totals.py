@@ -0,0 +1,73 @@
+"""Add orders.counted and archived_order_totals
+
+Revision ID: d6b1f3a8e250
+Revises: 9c2d5e8a4f17
+Create Date: 2026-10-19 18:07:52.416903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6b1f3a8e250'
+down_revision: Union[str, None] = '9c2d5e8a4f17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('counted', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    # Orders already processed have been counted, except those whose task is still
+    # pending, which the task will count. Orders not processed yet are counted by their
+    # task once they are.
+    op.execute("""
+        UPDATE orders SET counted = true
+        WHERE status = 'PROCESSED'
+          AND id NOT IN (
+              SELECT CAST(CAST(payload AS json) ->> 'order_id' AS INTEGER) FROM deferred_tasks
+              WHERE name = 'apply_processed_order' AND status = 'pending'
+          )
+    """)
+    op.create_index(
+        'ix_orders_uncounted', 'orders', ['product_id'], unique=False,
+        postgresql_where=sa.text("status = 'PROCESSED' AND NOT counted")
+    )
+    op.create_table(
+        'archived_order_totals',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('blogger_id', sa.Integer(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('items_sold', sa.Integer(), nullable=False),
+        sa.Column('money_earned', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('product_id', 'blogger_id')
+    )
+    # Seed from partitions that were archived but kept as detached tables
+    connection = op.get_bind()
+    detached = connection.execute(sa.text("""
+        SELECT c.relname FROM pg_class c
+        WHERE c.relname ~ '^orders_[0-9]{6}$' AND c.relkind = 'r'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+    """)).scalars().all()
+    for name in detached:
+        op.execute(f"""
+            INSERT INTO archived_order_totals (product_id, blogger_id, order_count, items_sold, money_earned)
+            SELECT product_id, blogger_id, COUNT(*), COALESCE(SUM(quantity), 0),
+                   COALESCE(SUM(quantity * price_per_item), 0)
+            FROM {name}
+            WHERE status = 'PROCESSED' AND product_id IS NOT NULL AND blogger_id IS NOT NULL
+            GROUP BY product_id, blogger_id
+            ON CONFLICT (product_id, blogger_id) DO UPDATE SET
+                order_count = archived_order_totals.order_count + excluded.order_count,
+                items_sold = archived_order_totals.items_sold + excluded.items_sold,
+                money_earned = archived_order_totals.money_earned + excluded.money_earned
+        """)
+
+
+def downgrade() -> None:
+    op.drop_table('archived_order_totals')
+    op.drop_index('ix_orders_uncounted', table_name='orders')
+    op.drop_column('orders', 'counted')
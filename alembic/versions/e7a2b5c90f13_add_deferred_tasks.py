@@ -0,0 +1,39 @@
+"""Add deferred_tasks
+
+Revision ID: e7a2b5c90f13
+Revises: c41a9e07b2d6
+Create Date: 2026-10-19 11:48:20.337105
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a2b5c90f13'
+down_revision: Union[str, None] = 'c41a9e07b2d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'deferred_tasks',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), server_default='pending', nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('run_after', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_deferred_tasks_pending', 'deferred_tasks', ['status', 'run_after', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deferred_tasks_pending', table_name='deferred_tasks')
+    op.drop_table('deferred_tasks')
@@ -0,0 +1,337 @@
+"""
+Recompute the order counters of Analytics from the orders themselves.
+
+Analytics.order_count, items_sold and money_earned are kept up to date by increments
+when an order is processed, so a lost increment or an order cancelled after processing
+leaves them wrong. Reconciliation aggregates processed orders per (product, blogger)
+in the database, one batch at a time, compares the totals with Analytics in the same
+statement and applies the difference to the pairs that drifted.
+
+Only counted orders are taken as the truth: an order whose apply_processed_order task
+is still queued is not in Analytics yet, and a cancelled one whose retract_cancelled_order
+task is still queued is not out of it yet, so both are left to their tasks. Orders of
+archived partitions come from archived_order_totals, so detaching a partition changes nothing.
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List, Optional, Tuple
+from sqlalchemy import Float, Integer, and_, column, func, or_, select, tuple_, union_all, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import logging
+import os
+
+from . import models, leaderboard, blogger_earnings
+from .database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Products whose orders are aggregated per batch in a full run
+RECONCILE_PRODUCTS_PER_BATCH = int(os.getenv("RECONCILE_PRODUCTS_PER_BATCH", "500"))
+# Pairs recomputed per batch in an incremental run
+RECONCILE_PAIRS_PER_BATCH = int(os.getenv("RECONCILE_PAIRS_PER_BATCH", "5000"))
+# Incremental runs look this far behind the checkpoint, for transactions that committed
+# after the previous run started. Processed orders still uncounted after this long
+# have lost their task and are counted by reconciliation instead.
+RECONCILE_OVERLAP_SECONDS = float(os.getenv("RECONCILE_OVERLAP_SECONDS", "300"))
+# Differences in money_earned below this are float noise, not drift
+MONEY_TOLERANCE = 0.005
+
+CHECKPOINT_NAME = "analytics-order-counters"
+COUNTERS = ("order_count", "items_sold", "money_earned")
+
+# The pairs a batch covers, as criteria on any model with product_id and blogger_id
+PairFilter = Callable[[type], list]
+
+
+def _order_totals(pairs: PairFilter):
+    """True counters per pair: counted orders, plus those archived"""
+    order, archived = models.Order, models.ArchivedOrderTotals
+    attached = select(
+        order.product_id,
+        order.blogger_id,
+        func.count().label("order_count"),
+        func.coalesce(func.sum(order.quantity), 0).label("items_sold"),
+        func.coalesce(func.sum(order.quantity * order.price_per_item), 0.0).label("money_earned"),
+    )\
+        .where(
+            order.counted,
+            order.product_id.isnot(None),
+            order.blogger_id.isnot(None),
+            *pairs(order)
+        )\
+        .group_by(order.product_id, order.blogger_id)
+    detached = select(
+        archived.product_id,
+        archived.blogger_id,
+        archived.order_count,
+        archived.items_sold,
+        archived.money_earned,
+    ).where(*pairs(archived))
+    parts = union_all(attached, detached).subquery("parts")
+    return select(
+        parts.c.product_id,
+        parts.c.blogger_id,
+        *[func.sum(parts.c[counter]).label(counter) for counter in COUNTERS],
+    )\
+        .group_by(parts.c.product_id, parts.c.blogger_id)\
+        .subquery("truth")
+
+
+def _analytics_totals(pairs: PairFilter):
+    """Stored counters per pair; duplicate rows of a pair are summed, the oldest takes corrections"""
+    analytics = models.Analytics
+    return select(
+        analytics.product_id,
+        analytics.blogger_id,
+        func.min(analytics.id).label("analytics_id"),
+        func.coalesce(func.sum(analytics.order_count), 0).label("order_count"),
+        func.coalesce(func.sum(analytics.items_sold), 0).label("items_sold"),
+        func.coalesce(func.sum(analytics.money_earned), 0.0).label("money_earned"),
+    )\
+        .where(analytics.product_id.isnot(None), analytics.blogger_id.isnot(None), *pairs(analytics))\
+        .group_by(analytics.product_id, analytics.blogger_id)\
+        .subquery("stored")
+
+
+def drift_query(pairs: PairFilter):
+    """Pairs whose stored counters differ from their orders, with both sides' values"""
+    truth = _order_totals(pairs)
+    stored = _analytics_totals(pairs)
+    true_values = [func.coalesce(truth.c[counter], 0) for counter in COUNTERS]
+    stored_values = [func.coalesce(stored.c[counter], 0) for counter in COUNTERS]
+    return select(
+        func.coalesce(truth.c.product_id, stored.c.product_id).label("product_id"),
+        func.coalesce(truth.c.blogger_id, stored.c.blogger_id).label("blogger_id"),
+        stored.c.analytics_id,
+        *[value.label(f"true_{counter}") for value, counter in zip(true_values, COUNTERS)],
+        *[value.label(f"stored_{counter}") for value, counter in zip(stored_values, COUNTERS)],
+    )\
+        .select_from(truth.join(
+            stored,
+            and_(truth.c.product_id == stored.c.product_id, truth.c.blogger_id == stored.c.blogger_id),
+            full=True
+        ))\
+        .where(or_(
+            true_values[0] != stored_values[0],
+            true_values[1] != stored_values[1],
+            func.abs(true_values[2] - stored_values[2]) > MONEY_TOLERANCE
+        ))
+
+
+def _product_batches(batch_size: int) -> Iterator[Tuple[int, int]]:
+    """Consecutive (first, last) product id ranges of batch_size products each"""
+    last = None
+    with engine.connect() as connection:
+        while True:
+            query = select(models.Product.id).order_by(models.Product.id).limit(batch_size)
+            if last is not None:
+                query = query.where(models.Product.id > last)
+            ids = connection.execute(query).scalars().all()
+            if not ids:
+                return
+            yield ids[0], ids[-1]
+            last = ids[-1]
+
+
+def _changed_pair_batches(since: datetime, batch_size: int) -> Iterator[List[Tuple[int, int]]]:
+    """
+    Pairs with an order whose status changed since the given time.
+    Orders are created waiting and every status change stamps updated_at,
+    so no order can start or stop counting without showing up here.
+    """
+    order = models.Order
+    pairs = select(order.product_id, order.blogger_id)\
+        .where(order.updated_at >= since, order.product_id.isnot(None), order.blogger_id.isnot(None))\
+        .distinct()
+    with engine.connect() as reader:
+        result = reader.execution_options(stream_results=True, yield_per=batch_size).execute(pairs)
+        for chunk in result.partitions():
+            yield [tuple(pair) for pair in chunk]
+
+
+def _count_lost_orders(db: Session, pairs: PairFilter, before: datetime, stats: dict) -> None:
+    """
+    Settle orders last changed before the given time whose task was lost: processed ones
+    still uncounted are marked counted and added to blogger earnings, and cancelled ones
+    still counted are unmarked and taken back out. Their Analytics and leaderboard share
+    then shows up as drift in the same batch. Rows are locked, so an order whose task
+    is running right now is settled only once.
+    """
+    order = models.Order
+    lost = db.query(order)\
+        .filter(
+            order.status == models.OrderStatus.PROCESSED,
+            ~order.counted,
+            order.updated_at < before,
+            *pairs(order)
+        )
+    stale = db.query(order)\
+        .filter(
+            order.status != models.OrderStatus.PROCESSED,
+            order.counted,
+            order.updated_at < before,
+            *pairs(order)
+        )
+    if stats["dry_run"]:
+        stats["lost"] += lost.count()
+        stats["retracted"] += stale.count()
+        return
+    for item in lost.with_for_update():
+        item.counted = True
+        blogger_earnings.record_order(db, item)
+        stats["lost"] += 1
+    for item in stale.with_for_update():
+        item.counted = False
+        blogger_earnings.record_order(db, item, -1)
+        stats["retracted"] += 1
+    db.flush()
+
+
+def _apply(db: Session, drifted, stats: dict) -> None:
+    """Add each pair's difference to its oldest Analytics row, or create the row"""
+    corrections, missing = [], []
+    for row in drifted:
+        deltas = {counter: row[f"true_{counter}"] - row[f"stored_{counter}"] for counter in COUNTERS}
+        stats["drifted"] += 1
+        stats["order_count"] += abs(deltas["order_count"])
+        stats["items_sold"] += abs(deltas["items_sold"])
+        stats["money_earned"] += abs(deltas["money_earned"])
+        stats["net_money_earned"] += deltas["money_earned"]
+        if abs(deltas["money_earned"]) > stats["max_money_drift"]:
+            stats["max_money_drift"] = abs(deltas["money_earned"])
+            stats["max_money_drift_pair"] = (row["product_id"], row["blogger_id"])
+        correction = {"product_id": row["product_id"], "blogger_id": row["blogger_id"], **deltas}
+        if row["analytics_id"] is None:
+            missing.append(correction)
+        else:
+            corrections.append({"analytics_id": row["analytics_id"], **correction})
+
+    if stats["dry_run"] or not (corrections or missing):
+        return
+    analytics = models.Analytics
+    if corrections:
+        # Relative update, so increments committed while the batch ran are kept
+        delta_rows = values(
+            column("analytics_id", Integer),
+            *[column(counter, Float if counter == "money_earned" else Integer) for counter in COUNTERS],
+            name="deltas"
+        ).data([tuple(item[key] for key in ("analytics_id", *COUNTERS)) for item in corrections])
+        db.execute(
+            update(analytics)
+            .where(analytics.id == delta_rows.c.analytics_id)
+            .values({
+                counter: func.coalesce(getattr(analytics, counter), 0) + delta_rows.c[counter]
+                for counter in COUNTERS
+            })
+        )
+    if missing:
+        # Pairs with no Analytics row yet; the deltas are the full counters
+        db.execute(insert(analytics).values([{"visit_count": 0, **item} for item in missing]))
+    leaderboard.record_corrections(db, [
+        {key: item[key] for key in ("product_id", "blogger_id", *COUNTERS)}
+        for item in corrections + missing
+    ])
+    stats["updated"] += len(corrections)
+    stats["created"] += len(missing)
+
+
+def _reconcile_batch(pairs: PairFilter, lost_before: datetime, stats: dict) -> None:
+    db = SessionLocal()
+    try:
+        _count_lost_orders(db, pairs, lost_before, stats)
+        drifted = db.execute(drift_query(pairs)).mappings().all()
+        _apply(db, drifted, stats)
+        db.commit()
+    finally:
+        db.close()
+    stats["batches"] += 1
+
+
+def load_checkpoint(db: Session, name: str = CHECKPOINT_NAME) -> Optional[datetime]:
+    return db.query(models.JobCheckpoint.checkpoint)\
+        .filter(models.JobCheckpoint.name == name)\
+        .scalar()
+
+
+def save_checkpoint(db: Session, checkpoint: datetime, name: str = CHECKPOINT_NAME) -> None:
+    """Record where a run started. The caller commits."""
+    stmt = insert(models.JobCheckpoint).values(name=name, checkpoint=checkpoint)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.JobCheckpoint.name],
+        set_={"checkpoint": stmt.excluded.checkpoint, "updated_at": func.now()}
+    ))
+
+
+def reconcile_order_counters(
+    incremental: bool = False,
+    products_per_batch: int = RECONCILE_PRODUCTS_PER_BATCH,
+    pairs_per_batch: int = RECONCILE_PAIRS_PER_BATCH,
+    overlap_seconds: float = RECONCILE_OVERLAP_SECONDS,
+    dry_run: bool = False
+) -> dict:
+    """
+    Correct Analytics order counters that drifted from the orders table.
+
+    A full run walks all products in id ranges; an incremental run only rechecks pairs
+    with orders changed since the last checkpoint, and falls back to a full run when
+    there is none. Every batch is aggregated, compared and corrected in its own
+    transaction, so memory and lock time stay bounded however many orders there are.
+    Processed orders uncounted, and cancelled orders still counted, for longer than
+    overlap_seconds are settled on the way.
+    Returns drift statistics.
+    """
+    db = SessionLocal()
+    try:
+        started = db.query(func.now()).scalar()
+        checkpoint = load_checkpoint(db) if incremental else None
+    finally:
+        db.close()
+
+    stats = {
+        "mode": "incremental" if checkpoint is not None else "full",
+        "since": None,
+        "dry_run": dry_run,
+        "batches": 0,
+        "lost": 0,
+        "retracted": 0,
+        "drifted": 0,
+        "updated": 0,
+        "created": 0,
+        "order_count": 0,
+        "items_sold": 0,
+        "money_earned": 0.0,
+        "net_money_earned": 0.0,
+        "max_money_drift": 0.0,
+        "max_money_drift_pair": None,
+    }
+    lost_before = started - timedelta(seconds=overlap_seconds)
+    if checkpoint is not None:
+        since = checkpoint - timedelta(seconds=overlap_seconds)
+        stats["since"] = since
+        for batch in _changed_pair_batches(since, pairs_per_batch):
+            _reconcile_batch(
+                lambda model, batch=batch: [tuple_(model.product_id, model.blogger_id).in_(batch)],
+                lost_before,
+                stats
+            )
+    else:
+        for first, last in _product_batches(products_per_batch):
+            _reconcile_batch(
+                lambda model, first=first, last=last: [model.product_id.between(first, last)],
+                lost_before,
+                stats
+            )
+
+    if not dry_run:
+        db = SessionLocal()
+        try:
+            save_checkpoint(db, started)
+            db.commit()
+        finally:
+            db.close()
+    logger.info(
+        "Analytics reconciliation (%s): %d pairs drifted, %.2f money_earned corrected, "
+        "%d lost orders counted, %d cancelled orders retracted",
+        stats["mode"], stats["drifted"], stats["money_earned"], stats["lost"], stats["retracted"]
+    )
+    return stats
@@ -0,0 +1,80 @@
+from sqlalchemy.orm import Session
+
+from . import models, leaderboard, live_analytics, blogger_earnings
+from .tasks import task
+from .unique_visitors import record_unique_visit
+
+
+def _increment_analytics(db: Session, product_id: int, blogger_id: int, **deltas) -> int:
+    """Add deltas in SQL so concurrent workers never lose each other's increments"""
+    return db.query(models.Analytics)\
+        .filter(
+            models.Analytics.product_id == product_id,
+            models.Analytics.blogger_id == blogger_id
+        )\
+        .update(
+            {getattr(models.Analytics, column): getattr(models.Analytics, column) + delta for column, delta in deltas.items()},
+            synchronize_session=False
+        )
+
+
+@task("record_visit")
+def record_visit(db: Session, product_id: int, blogger_id: int, fingerprint: str) -> None:
+    """Count a visit through a blogger's link in Analytics, the leaderboard and the unique visitor sketch"""
+    if not _increment_analytics(db, product_id, blogger_id, visit_count=1):
+        db.add(models.Analytics(
+            product_id=product_id,
+            blogger_id=blogger_id,
+            visit_count=1
+        ))
+    
+    leaderboard.record_visit(db, product_id, blogger_id)
+    record_unique_visit(db, product_id, blogger_id, fingerprint)
+    live_analytics.publish(db, product_id, blogger_id, visit_count=1)
+
+
+def _order_deltas(order: models.Order, sign: int = 1) -> dict:
+    return {
+        "order_count": sign,
+        "items_sold": sign * order.quantity,
+        "money_earned": sign * order.quantity * order.price_per_item,
+    }
+
+
+def _record_order(db: Session, order: models.Order, sign: int) -> None:
+    deltas = _order_deltas(order, sign)
+    updated = _increment_analytics(db, order.product_id, order.blogger_id, **deltas)
+    if updated:
+        leaderboard.record_order(db, order, sign)
+        live_analytics.publish(db, order.product_id, order.blogger_id, **deltas)
+    # Earnings follow the orders themselves, whether or not the pair has an Analytics row
+    blogger_earnings.record_order(db, order, sign)
+
+
+@task("apply_processed_order")
+def apply_processed_order(db: Session, order_id: int) -> None:
+    """
+    Add a processed order to the Analytics of its (product, blogger) pair and to the blogger's earnings.
+    The order is locked and marked counted, so a repeated task or reconciliation never adds it twice.
+    """
+    order = db.query(models.Order).filter(models.Order.id == order_id).with_for_update().first()
+    # The order may have been cancelled while its task was queued
+    if not order or order.counted or order.status != models.OrderStatus.PROCESSED:
+        return
+    order.counted = True
+    _record_order(db, order, 1)
+
+
+@task("retract_cancelled_order")
+def retract_cancelled_order(db: Session, order_id: int) -> None:
+    """
+    Take an order that left the processed status back out of Analytics, the leaderboard
+    and the blogger's earnings. Only a counted order is retracted, and its mark is cleared,
+    so processing it again later adds it back exactly once.
+    """
+    order = db.query(models.Order).filter(models.Order.id == order_id).with_for_update().first()
+    # The order may have been processed again, or never counted, before this ran
+    if not order or not order.counted or order.status == models.OrderStatus.PROCESSED:
+        return
+    order.counted = False
+    _record_order(db, order, -1)
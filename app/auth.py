@@ -1,11 +1,11 @@
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from . import models, schemas
-from .database import get_db
+from .database import SessionLocal, get_db
 import os
 from dotenv import load_dotenv
 import hashlib
@@ -17,8 +17,12 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Shared secret for operational endpoints under /admin; they are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# EventSource cannot send headers, so streams also accept the token as a query parameter
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 def get_password_hash(password: str) -> str:
     """Hash a password for storing."""
@@ -69,12 +73,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_shop(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def shop_from_token(db: Session, token: Optional[str]) -> models.Shop:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -86,4 +92,46 @@ async def get_current_shop(token: str = Depends(oauth2_scheme), db: Session = De
     shop = db.query(models.Shop).filter(models.Shop.email == token_data.email).first()
     if shop is None:
         raise credentials_exception
-    return shop
\ No newline at end of file
+    return shop
+
+async def get_current_shop(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return shop_from_token(db, token)
+
+def get_shop_scope(
+    x_admin_token: Optional[str] = Header(None),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> Optional[int]:
+    """None for operators presenting the admin token (every shop), else the authenticated shop's id"""
+    if ADMIN_TOKEN and x_admin_token and hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        return None
+    return shop_from_token(db, token).id
+
+class StreamGrant(NamedTuple):
+    shop_id: int
+    # When the token stops being valid; the stream is closed then
+    expires_at: Optional[datetime]
+
+def get_stream_grant(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    access_token: Optional[str] = Query(None)
+) -> StreamGrant:
+    """Authenticate a long-lived stream without holding a database session for its whole lifetime"""
+    token = token or access_token
+    db = SessionLocal()
+    try:
+        shop_id = shop_from_token(db, token).id
+    finally:
+        db.close()
+    # Already verified by shop_from_token
+    exp = jwt.get_unverified_claims(token).get("exp")
+    expires_at = datetime.fromtimestamp(exp, timezone.utc) if exp is not None else None
+    return StreamGrant(shop_id, expires_at)
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Guard operational endpoints with the ADMIN_TOKEN shared secret"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token"
+        )
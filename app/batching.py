@@ -0,0 +1,43 @@
+from typing import Dict, Iterable, List, Tuple, TypeVar
+import os
+
+# Upper bound on ids per multi-get request
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "100"))
+# Ids are Postgres integer columns; anything outside this range cannot exist
+MIN_ID, MAX_ID = -2**31, 2**31 - 1
+
+T = TypeVar("T")
+
+
+class InvalidBatch(ValueError):
+    pass
+
+
+def parse_ids(values: Iterable[str], max_ids: int = BATCH_MAX_IDS) -> List[int]:
+    """
+    Read ids given as ids=1,2,3 or as repeated ids=1&ids=2.
+    Duplicates are dropped and the first occurrence keeps its position.
+    """
+    ids: Dict[int, None] = {}
+    for value in values:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                id_ = int(part)
+            except ValueError:
+                raise InvalidBatch(f"Invalid id: {part!r}")
+            if not MIN_ID <= id_ <= MAX_ID:
+                raise InvalidBatch(f"Id out of range: {part!r}")
+            ids[id_] = None
+    if not ids:
+        raise InvalidBatch("At least one id is required")
+    if len(ids) > max_ids:
+        raise InvalidBatch(f"At most {max_ids} ids can be requested at once")
+    return list(ids)
+
+
+def in_request_order(ids: List[int], found: Dict[int, T]) -> Tuple[List[T], List[int]]:
+    """Results in the order the ids were requested, and the ids nothing was found for"""
+    return [found[id_] for id_ in ids if id_ in found], [id_ for id_ in ids if id_ not in found]
@@ -0,0 +1,170 @@
+"""
+Per-blogger earnings by shop and month, kept in step with order processing.
+
+Rows are keyed by the month of the order's created_at in UTC, so rebuilding them from
+orders gives the same split as the increments made when each order was processed.
+"""
+from datetime import date, datetime, timezone
+from itertools import groupby
+from typing import Iterator, List, Optional
+from sqlalchemy import Date, and_, cast, delete, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import engine
+from .order_partitions import month_start
+from .projections import projection
+
+_earnings = models.BloggerEarnings
+COUNTERS = ("order_count", "items_sold", "money_earned")
+# Rows fetched per round trip while streaming payout statements
+PAYOUT_FETCH_SIZE = 5000
+
+
+def order_month(created_at: datetime) -> date:
+    return month_start(created_at.astimezone(timezone.utc))
+
+
+def record_order(db: Session, order: models.Order, sign: int = 1) -> None:
+    """
+    Add a processed order to its blogger's earnings at the product's shop, or with sign -1
+    take a cancelled one back out. The caller commits.
+    """
+    source = select(
+        literal(order.blogger_id),
+        models.Product.shop_id,
+        literal(order_month(order.created_at)),
+        literal(sign),
+        literal(sign * order.quantity),
+        literal(sign * order.quantity * order.price_per_item),
+    ).where(models.Product.id == order.product_id, models.Product.shop_id.isnot(None))
+    stmt = insert(_earnings).from_select(["blogger_id", "shop_id", "month", *COUNTERS], source)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_blogger_earnings_blogger_shop_month",
+        set_={
+            **{counter: getattr(_earnings, counter) + stmt.excluded[counter] for counter in COUNTERS},
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def rebuild(db: Session, since: Optional[date] = None) -> int:
+    """
+    Recompute earnings from counted orders for since's month onwards, and never
+    before the oldest order still in the table. Earlier months are left alone, so history
+    whose orders partitions were archived is kept. Returns the rows written; the caller commits.
+    """
+    order = models.Order
+    oldest = db.query(func.min(order.created_at)).scalar()
+    if oldest is None:
+        return 0
+    since = max(month_start(since), order_month(oldest)) if since else order_month(oldest)
+
+    month = cast(func.date_trunc("month", func.timezone("UTC", order.created_at)), Date)
+    totals = select(
+        order.blogger_id,
+        models.Product.shop_id,
+        month,
+        func.count(),
+        func.coalesce(func.sum(order.quantity), 0),
+        func.coalesce(func.sum(order.quantity * order.price_per_item), 0.0),
+    )\
+        .join(models.Product, order.product_id == models.Product.id)\
+        .where(
+            order.counted,
+            order.blogger_id.isnot(None),
+            models.Product.shop_id.isnot(None),
+            order.created_at >= datetime(since.year, since.month, 1, tzinfo=timezone.utc)
+        )\
+        .group_by(order.blogger_id, models.Product.shop_id, month)
+
+    stmt = insert(_earnings).from_select(["blogger_id", "shop_id", "month", *COUNTERS], totals)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_blogger_earnings_blogger_shop_month",
+        set_={
+            **{counter: stmt.excluded[counter] for counter in COUNTERS},
+            "updated_at": func.now(),
+        },
+    )
+    written = db.execute(stmt).rowcount
+
+    # Rows whose orders were all taken back out since they were counted
+    has_orders = exists().where(
+        and_(
+            order.blogger_id == _earnings.blogger_id,
+            order.product_id == models.Product.id,
+            models.Product.shop_id == _earnings.shop_id,
+            order.counted,
+            cast(func.date_trunc("month", func.timezone("UTC", order.created_at)), Date) == _earnings.month
+        )
+    )
+    db.execute(delete(_earnings).where(_earnings.month >= since, ~has_orders))
+    return written
+
+
+def blogger_earnings(
+    db: Session,
+    blogger_id: int,
+    shop_id: Optional[int] = None,
+    start_month: Optional[date] = None,
+    end_month: Optional[date] = None
+) -> List[dict]:
+    """A blogger's rows as plain dicts, newest month first"""
+    rows = projection(_earnings, schemas.EarningsPeriod)
+    stmt = rows.select().where(_earnings.blogger_id == blogger_id)
+    if shop_id is not None:
+        stmt = stmt.where(_earnings.shop_id == shop_id)
+    if start_month:
+        stmt = stmt.where(_earnings.month >= month_start(start_month))
+    if end_month:
+        stmt = stmt.where(_earnings.month <= month_start(end_month))
+    return rows.rows(db.execute(stmt.order_by(_earnings.month.desc(), _earnings.shop_id)))
+
+
+def payout_statements(month: date) -> Iterator[dict]:
+    """
+    Every blogger's statement for a month, read in one pass over the month's rows.
+    Rows stream from a server-side cursor in blogger order and are grouped as they
+    arrive, so memory holds one statement at a time.
+    """
+    month = month_start(month)
+    rows = select(
+        _earnings.blogger_id,
+        models.Blogger.name.label("blogger_name"),
+        models.Blogger.email.label("blogger_email"),
+        _earnings.shop_id,
+        models.Shop.name.label("shop_name"),
+        _earnings.order_count,
+        _earnings.items_sold,
+        _earnings.money_earned,
+    )\
+        .join(models.Blogger, models.Blogger.id == _earnings.blogger_id)\
+        .join(models.Shop, models.Shop.id == _earnings.shop_id)\
+        .where(_earnings.month == month)\
+        .order_by(_earnings.blogger_id, _earnings.shop_id)
+
+    with engine.connect() as reader:
+        result = reader.execution_options(stream_results=True, yield_per=PAYOUT_FETCH_SIZE).execute(rows)
+        for blogger_id, lines in groupby(result, key=lambda row: row.blogger_id):
+            lines = list(lines)
+            yield {
+                "month": month.isoformat(),
+                "blogger_id": blogger_id,
+                "blogger_name": lines[0].blogger_name,
+                "blogger_email": lines[0].blogger_email,
+                "shops": [
+                    {
+                        "shop_id": line.shop_id,
+                        "shop_name": line.shop_name,
+                        "order_count": line.order_count,
+                        "items_sold": line.items_sold,
+                        "money_earned": line.money_earned,
+                    }
+                    for line in lines
+                ],
+                "order_count": sum(line.order_count for line in lines),
+                "items_sold": sum(line.items_sold for line in lines),
+                "money_earned": sum(line.money_earned for line in lines),
+            }
@@ -0,0 +1,177 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Set
+from fastapi import Request
+import csv
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+
+from .database import background_engine
+
+logger = logging.getLogger(__name__)
+
+CLICK_LOG_QUEUE_SIZE = int(os.getenv("CLICK_LOG_QUEUE_SIZE", "10000"))
+CLICK_LOG_BATCH_SIZE = int(os.getenv("CLICK_LOG_BATCH_SIZE", "500"))
+CLICK_LOG_FLUSH_SECONDS = float(os.getenv("CLICK_LOG_FLUSH_SECONDS", "1.0"))
+
+# Sources that increment Analytics.visit_count
+SOURCE_PRODUCT_VIEW = "product_view"
+SOURCE_LINK_RESOLVE = "link_resolve"
+VISIT_SOURCES = (SOURCE_PRODUCT_VIEW,)
+
+_COPY_COLUMNS = ("occurred_at", "source", "product_id", "blogger_id", "link_code", "referrer", "user_agent_hash")
+
+
+@dataclass
+class ClickEventRecord:
+    occurred_at: datetime
+    source: str
+    product_id: Optional[int]
+    blogger_id: Optional[int]
+    link_code: Optional[str]
+    referrer: Optional[str]
+    user_agent_hash: Optional[str]
+
+    def as_row(self) -> list:
+        return [
+            self.occurred_at.isoformat(),
+            self.source,
+            self.product_id,
+            self.blogger_id,
+            self.link_code,
+            self.referrer,
+            self.user_agent_hash,
+        ]
+
+
+def partition_name(day: date) -> str:
+    return f"click_events_{day:%Y%m%d}"
+
+
+def ensure_partition(cursor, day: date) -> None:
+    """Create the daily partition covering day if it does not exist yet"""
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF click_events "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def event_from_request(
+    request: Request,
+    source: str,
+    product_id: Optional[int],
+    blogger_id: Optional[int] = None,
+    link_code: Optional[str] = None
+) -> ClickEventRecord:
+    user_agent = request.headers.get("user-agent")
+    return ClickEventRecord(
+        occurred_at=datetime.now(timezone.utc),
+        source=source,
+        product_id=product_id,
+        blogger_id=blogger_id,
+        link_code=link_code,
+        referrer=request.headers.get("referer"),
+        user_agent_hash=hashlib.sha256(user_agent.encode("utf-8")).hexdigest()[:32] if user_agent else None,
+    )
+
+
+class ClickEventWriter:
+    """
+    Buffers click events in memory and writes them with COPY from a background thread.
+    submit() never blocks or touches the database; when the buffer is full the
+    event is dropped and counted instead of slowing the request down.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = CLICK_LOG_QUEUE_SIZE,
+        batch_size: int = CLICK_LOG_BATCH_SIZE,
+        flush_seconds: float = CLICK_LOG_FLUSH_SECONDS
+    ):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[ClickEventRecord]" = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._known_partitions: Set[date] = set()
+
+    def submit(self, event: ClickEventRecord) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="click-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the writer after flushing whatever is still buffered"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+                self.written += len(batch)
+            except Exception:
+                logger.exception("Failed to write %d click events", len(batch))
+
+    def _next_batch(self) -> List[ClickEventRecord]:
+        batch: List[ClickEventRecord] = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_seconds))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[ClickEventRecord]) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        days = set()
+        for event in batch:
+            writer.writerow(event.as_row())
+            days.add(event.occurred_at.astimezone(timezone.utc).date())
+        buffer.seek(0)
+
+        connection = background_engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for day in days - self._known_partitions:
+                ensure_partition(cursor, day)
+            cursor.copy_expert(
+                f"COPY click_events ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+            connection.commit()
+            self._known_partitions.update(days)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+
+click_writer = ClickEventWriter()
@@ -0,0 +1,18 @@
+from fastapi import Request
+import os
+
+# Reverse proxies in front of the app that append to X-Forwarded-For (1 on Render);
+# 0 ignores the header, since clients can put anything in it
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+
+def client_address(request: Request, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """
+    The address the outermost trusted proxy saw the request come from. Entries to the
+    left of those the trusted proxies appended were sent by the client and are ignored.
+    """
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if trusted_hops > 0 and forwarded_for:
+        entries = [entry.strip() for entry in forwarded_for.split(",")]
+        return entries[max(len(entries) - trusted_hops, 0)]
+    return request.client.host if request.client else ""
@@ -0,0 +1,190 @@
+from typing import Any, Dict, Optional, Set
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from psycopg2 import errors
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+import os
+import threading
+
+from .load_shedding import EXPENSIVE_ROUTES, route_template
+
+logger = logging.getLogger(__name__)
+
+# Longest a single statement of a request may run; 0 disables the limit
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "5000"))
+
+# Per-route deadlines, overridable with ROUTE_STATEMENT_TIMEOUTS="GET /a/{id}=15000,GET /b=0"
+DEFAULT_ROUTE_STATEMENT_TIMEOUTS = {
+    "GET /shops/{shop_id}/analytics": 15000,
+    "GET /shops/{shop_id}/unique-visitors": 15000,
+    "GET /products/{product_id}/unique-visitors": 15000,
+    # Applies to each fetch from the export cursor, not to the whole download
+    "GET /shops/{shop_id}/orders/export": 60000,
+}
+
+# Reads and exports whose queries are cancelled as soon as the client goes away
+CANCEL_ON_DISCONNECT_ROUTES = EXPENSIVE_ROUTES
+
+# nginx's code for a request the client abandoned; nobody is left to read it
+CLIENT_CLOSED_REQUEST = 499
+
+# Where the guard is kept in the ASGI scope and in Session.info
+_GUARD = "query_guard"
+
+
+def parse_route_timeouts(value: Optional[str]) -> Dict[str, int]:
+    timeouts = dict(DEFAULT_ROUTE_STATEMENT_TIMEOUTS)
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        route, timeout = item.rsplit("=", 1)
+        timeouts[route.strip()] = int(timeout)
+    return timeouts
+
+
+ROUTE_STATEMENT_TIMEOUTS = parse_route_timeouts(os.getenv("ROUTE_STATEMENT_TIMEOUTS"))
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class QueryGuard:
+    """Statement deadline of one request and the database connections it is using"""
+
+    def __init__(self, route: str, statement_timeout_ms: int):
+        self.route = route
+        self.statement_timeout_ms = statement_timeout_ms
+        self.disconnected = False
+        self.connections: Set[Any] = set()
+
+    def cancel(self) -> None:
+        """Stop whatever the request's connections are running; new statements fail at once"""
+        with _guards_lock:
+            self.disconnected = True
+            for connection in self.connections:
+                try:
+                    connection.cancel()
+                except Exception:
+                    logger.warning("Could not cancel a query of %s", self.route, exc_info=True)
+
+
+# Connections checked out by guarded requests. Cancelling and returning a connection to
+# the pool take the same lock, so a cancel never reaches a connection another request reuses.
+_guards: Dict[Any, QueryGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def apply_deadline(db: Session, request: Request) -> Session:
+    """Put db under the deadline and cancellation of the request it serves"""
+    guard = request.scope.get(_GUARD)
+    if guard is not None:
+        db.info[_GUARD] = guard
+    return db
+
+
+@event.listens_for(Session, "after_begin")
+def _start_guarded_transaction(session: Session, transaction, connection) -> None:
+    guard = session.info.get(_GUARD)
+    if guard is None:
+        return
+    dbapi_connection = connection.connection.dbapi_connection
+    with _guards_lock:
+        _guards[dbapi_connection] = guard
+        guard.connections.add(dbapi_connection)
+    if guard.statement_timeout_ms:
+        # SET LOCAL ends with the transaction, so the pooled connection comes back clean
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(guard.statement_timeout_ms)}")
+
+
+def guard_engine(engine: Engine) -> None:
+    """Refuse statements of abandoned requests and forget connections when they return to the pool"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        guard = _guards.get(conn.connection.dbapi_connection)
+        if guard is not None and guard.disconnected:
+            raise ClientDisconnected(guard.route)
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        with _guards_lock:
+            guard = _guards.pop(dbapi_connection, None)
+            if guard is not None:
+                guard.connections.discard(dbapi_connection)
+
+
+def statement_timeout_ms(route: str) -> int:
+    return ROUTE_STATEMENT_TIMEOUTS.get(route, STATEMENT_TIMEOUT_MS)
+
+
+def is_query_canceled(exc: BaseException) -> bool:
+    return isinstance(exc, OperationalError) and isinstance(exc.orig, errors.QueryCanceled)
+
+
+def deadline_response(request: Request, exc: Exception) -> Optional[JSONResponse]:
+    """The response for a statement stopped by its deadline or by a client that went away"""
+    guard = request.scope.get(_GUARD)
+    if isinstance(exc, ClientDisconnected) or (guard is not None and guard.disconnected):
+        return JSONResponse({"detail": "Client closed request"}, status_code=CLIENT_CLOSED_REQUEST)
+    if is_query_canceled(exc):
+        logger.warning("Statement deadline of %s exceeded", guard.route if guard else request.url.path)
+        return JSONResponse({"detail": "Database query timed out"}, status_code=504)
+    return None
+
+
+class QueryDeadlineMiddleware:
+    """
+    ASGI middleware that gives each request its route's statement deadline and, for
+    expensive reads and exports, cancels the request's running queries on the server
+    as soon as the client disconnects instead of letting them finish for nobody.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_template(scope)
+        guard = QueryGuard(route, statement_timeout_ms(route))
+        scope[_GUARD] = guard
+        if route not in CANCEL_ON_DISCONNECT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        # Read the client's messages ahead of the app so a disconnect is seen while
+        # queries run; the app still receives every message, disconnect included
+        messages: asyncio.Queue = asyncio.Queue()
+        # Servers also report a disconnect once the response is complete
+        response_sent = False
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_sent:
+                        logger.info("Client left %s, cancelling its queries", route)
+                        await run_in_threadpool(guard.cancel)
+                    return
+
+        async def send_and_track(message):
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await self.app(scope, messages.get, send_and_track)
+        finally:
+            watcher.cancel()
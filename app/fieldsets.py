@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from types import UnionType
+from typing import Any, List, Optional, Tuple, Type, Union, get_args, get_origin
+from fastapi import HTTPException, Query, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, create_model
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, noload
+
+FIELDS_DESCRIPTION = (
+    "Comma-separated fields to return, e.g. id,name,price. "
+    "Use dotted names such as blogger.name for related objects; a bare relation name returns all of its fields."
+)
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def nested_schema(annotation) -> Optional[Type[BaseModel]]:
+    """The schema a field embeds, unwrapping Optional[...] and List[...]"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        schema = nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def _replace_schema(annotation, schema: Type[BaseModel], subset: Type[BaseModel]):
+    if annotation is schema:
+        return subset
+    origin = get_origin(annotation)
+    if origin in (Union, UnionType):
+        return Optional[_replace_schema(next(arg for arg in get_args(annotation) if arg is not type(None)), schema, subset)]
+    if origin in (list, List):
+        return List[_replace_schema(get_args(annotation)[0], schema, subset)]
+    return annotation
+
+
+@dataclass(frozen=True)
+class FieldSet:
+    """A validated selection of a schema's fields, with nested selections for related objects"""
+    schema: Type[BaseModel]
+    fields: Tuple[str, ...]
+    nested: Tuple[Tuple[str, "FieldSet"], ...] = ()
+
+    @classmethod
+    def all_of(cls, schema: Type[BaseModel]) -> "FieldSet":
+        return cls(schema, tuple(name for name, info in schema.model_fields.items() if nested_schema(info.annotation) is None))
+
+    @classmethod
+    def parse(cls, schema: Type[BaseModel], fields: str) -> "FieldSet":
+        return _parse(schema, ",".join(sorted({part.strip() for part in fields.split(",") if part.strip()})))
+
+    def load_options(self, model, *required) -> list:
+        """
+        Loader options that fetch only the selected columns, join the selected
+        relationships and leave every other relationship unloaded.
+        required lists extra columns the endpoint itself needs.
+        """
+        mapper = inspect(model)
+        columns = [getattr(model, name) for name in self.fields if name in mapper.column_attrs]
+        columns.extend(required)
+        options = []
+        for name, nested in self.nested:
+            relationship = mapper.relationships[name]
+            columns.extend(getattr(model, column.key) for column in relationship.local_columns)
+            target = relationship.mapper.class_
+            options.append(joinedload(getattr(model, name)).options(*nested.load_options(target)))
+        for relationship in mapper.relationships:
+            if relationship.key not in dict(self.nested):
+                options.append(noload(getattr(model, relationship.key)))
+        if not columns:
+            columns = [getattr(model, column.key) for column in mapper.primary_key]
+        return [load_only(*columns), *options]
+
+    def dump(self, obj: Any) -> dict:
+        return _subset_model(self).model_validate(obj).model_dump(mode="json")
+
+    def render(self, obj: Any) -> JSONResponse:
+        """Serialize one object or a list of them, bypassing the endpoint's full response model"""
+        if isinstance(obj, (list, tuple)):
+            return JSONResponse([self.dump(item) for item in obj])
+        return JSONResponse(self.dump(obj))
+
+
+@lru_cache(maxsize=256)
+def _parse(schema: Type[BaseModel], fields: str) -> FieldSet:
+    if not fields:
+        raise InvalidFields("fields must name at least one field")
+    selected: List[str] = []
+    nested: dict = {}
+    for field in fields.split(","):
+        name, _, rest = field.partition(".")
+        info = schema.model_fields.get(name)
+        if info is None:
+            raise InvalidFields(f"Unknown field '{name}'; choose from {', '.join(schema.model_fields)}")
+        embedded = nested_schema(info.annotation)
+        if embedded is None:
+            if rest:
+                raise InvalidFields(f"Field '{name}' has no subfields")
+            selected.append(name)
+        elif rest:
+            # A bare relation name already selects all of its fields
+            if nested.get(name, []) is not None:
+                nested.setdefault(name, []).append(rest)
+        else:
+            nested[name] = None
+    nested_sets = []
+    for name, subfields in nested.items():
+        embedded = nested_schema(schema.model_fields[name].annotation)
+        try:
+            subset = FieldSet.all_of(embedded) if subfields is None else _parse(embedded, ",".join(sorted(subfields)))
+        except InvalidFields as e:
+            raise InvalidFields(f"{e} (in {name})")
+        nested_sets.append((name, subset))
+    # Keep the schema's field order so responses look the same whichever way fields are listed
+    order = list(schema.model_fields)
+    return FieldSet(
+        schema,
+        tuple(sorted(selected, key=order.index)),
+        tuple(sorted(nested_sets, key=lambda item: order.index(item[0])))
+    )
+
+
+@lru_cache(maxsize=256)
+def _subset_model(fieldset: FieldSet) -> Type[BaseModel]:
+    schema = fieldset.schema
+    definitions = {name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in fieldset.fields}
+    for name, nested in fieldset.nested:
+        info = schema.model_fields[name]
+        embedded = nested_schema(info.annotation)
+        annotation = _replace_schema(info.annotation, embedded, _subset_model(nested))
+        definitions[name] = (annotation, None if get_origin(info.annotation) in (Union, UnionType) else ...)
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions
+    )
+
+
+def selectable(schema: Type[BaseModel]):
+    """Dependency reading an optional fields= parameter validated against schema"""
+    def dependency(fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)) -> Optional[FieldSet]:
+        if fields is None:
+            return None
+        try:
+            return FieldSet.parse(schema, fields)
+        except InvalidFields as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    return dependency
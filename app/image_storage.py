@@ -0,0 +1,254 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+IMAGE_STORAGE_BACKEND = os.getenv("IMAGE_STORAGE_BACKEND", "local")
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", "uploads/products")
+# S3-compatible backend; S3_ENDPOINT_URL points it at MinIO or another stand-in
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "products/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION")
+IMAGE_URL_EXPIRES_SECONDS = int(os.getenv("IMAGE_URL_EXPIRES_SECONDS", "3600"))
+
+# Public URLs of stored images; the key follows this prefix
+IMAGE_URL_PREFIX = "/products/images/"
+
+_CHUNK_SIZE = 1024 * 1024
+_EXTENSION = re.compile(r"^\.[a-z0-9]{1,8}$")
+CONTENT_KEY = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+
+
+class InvalidImageKey(ValueError):
+    pass
+
+
+def content_key(digest: str, extension: str) -> str:
+    """Shard by the first two byte pairs of the hash, e.g. 3f/a2/3fa2...e1.png"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def image_extension(filename: Optional[str], content_type: Optional[str]) -> str:
+    extension = Path(filename or "").suffix.lower()
+    if not _EXTENSION.match(extension):
+        extension = mimetypes.guess_extension(content_type or "") or ""
+    return extension if _EXTENSION.match(extension) else ""
+
+
+def key_from_url(image_url: Optional[str]) -> Optional[str]:
+    if image_url and image_url.startswith(IMAGE_URL_PREFIX):
+        return image_url[len(IMAGE_URL_PREFIX):]
+    return None
+
+
+def _check_key(key: str) -> str:
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        raise InvalidImageKey(key)
+    return key
+
+
+class ImageStorage:
+    """Stores image bytes under keys; subclasses provide the actual backend"""
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def put(self, key: str, path: Path, content_type: Optional[str]) -> None:
+        raise NotImplementedError
+
+    def touch(self, key: str) -> None:
+        """Mark an existing object as recently used so garbage collection spares it"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def keys(self) -> Iterator[Tuple[str, datetime]]:
+        """Every stored key with its last modification time"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path to serve the image from, for backends that keep files on this machine"""
+        return None
+
+    def url(self, key: str) -> Optional[str]:
+        """Direct URL to redirect clients to, for remote backends"""
+        return None
+
+    def save(self, source: BinaryIO, filename: Optional[str], content_type: Optional[str]) -> str:
+        """
+        Store an upload under the hash of its content and return its key.
+        The upload is hashed while it is copied to a temporary file; if the same
+        content is already stored, the copy is discarded instead of written again.
+        """
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self._spool_dir(), prefix=".upload-", delete=False) as spool:
+            try:
+                for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    spool.write(chunk)
+            except BaseException:
+                os.unlink(spool.name)
+                raise
+        spool_path = Path(spool.name)
+        key = content_key(digest.hexdigest(), image_extension(filename, content_type))
+        try:
+            if self.exists(key):
+                self.touch(key)
+            else:
+                self.put(key, spool_path, content_type)
+        finally:
+            if spool_path.exists():
+                spool_path.unlink()
+        return key
+
+    def _spool_dir(self) -> Optional[str]:
+        return None
+
+    def spool_files(self) -> Iterator[Tuple[Path, datetime]]:
+        """Temporary files of uploads, with their last modification time; stale ones were interrupted"""
+        for path in Path(self._spool_dir() or tempfile.gettempdir()).glob(".upload-*"):
+            try:
+                modified = datetime.fromtimestamp(path.stat().st_mtime, timezone.utc)
+            except FileNotFoundError:
+                # The upload finished while we were looking
+                continue
+            yield path, modified
+
+
+class LocalImageStorage(ImageStorage):
+    def __init__(self, root: str = IMAGE_STORAGE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / _check_key(key)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def put(self, key: str, path: Path, content_type: Optional[str]) -> None:
+        target = self._path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Same filesystem as the spool file, so this is an atomic rename
+        os.replace(path, target)
+
+    def touch(self, key: str) -> None:
+        os.utime(self._path(key))
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        path.unlink(missing_ok=True)
+        # Drop shard directories left empty, but never the root itself
+        for parent in path.parents:
+            if parent == self.root:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
+    def keys(self) -> Iterator[Tuple[str, datetime]]:
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = Path(directory) / name
+                modified = datetime.fromtimestamp(path.stat().st_mtime, timezone.utc)
+                yield path.relative_to(self.root).as_posix(), modified
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    def _spool_dir(self) -> Optional[str]:
+        return str(self.root)
+
+
+class S3ImageStorage(ImageStorage):
+    """
+    Any S3-compatible object store. Requires boto3; credentials come from the usual
+    AWS environment variables. Images are served through short-lived presigned URLs.
+    """
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: Optional[str] = S3_REGION,
+        client=None
+    ):
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set to use the s3 image storage backend")
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The s3 image storage backend requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _object(self, key: str) -> str:
+        return self.prefix + _check_key(key)
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, key: str, path: Path, content_type: Optional[str]) -> None:
+        extra = {"ContentType": content_type} if content_type else {}
+        with path.open("rb") as data:
+            self.client.upload_fileobj(data, self.bucket, self._object(key), ExtraArgs=extra)
+
+    def touch(self, key: str) -> None:
+        # Copying an object onto itself refreshes LastModified; S3 only allows it when metadata is replaced
+        head = self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=self._object(key),
+            CopySource={"Bucket": self.bucket, "Key": self._object(key)},
+            MetadataDirective="REPLACE",
+            ContentType=head.get("ContentType", "binary/octet-stream")
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+
+    def keys(self) -> Iterator[Tuple[str, datetime]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", ()):
+                yield item["Key"][len(self.prefix):], item["LastModified"]
+
+    def url(self, key: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object(key)},
+            ExpiresIn=IMAGE_URL_EXPIRES_SECONDS
+        )
+
+
+def create_storage(backend: str = IMAGE_STORAGE_BACKEND) -> ImageStorage:
+    if backend == "local":
+        return LocalImageStorage()
+    if backend == "s3":
+        return S3ImageStorage()
+    raise RuntimeError(f"Unknown IMAGE_STORAGE_BACKEND: {backend}")
+
+
+image_storage = create_storage()
@@ -0,0 +1,215 @@
+from typing import List, Optional
+from sqlalchemy import Float, Integer, and_, column, delete, exists, func, literal, select, text, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, joinedload
+import enum
+import logging
+import os
+import threading
+
+from . import models
+from .database import BackgroundSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# How often each worker recomputes the leaderboard from Analytics; 0 disables it
+LEADERBOARD_RECONCILE_SECONDS = float(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "3600"))
+LEADERBOARD_MAX_LIMIT = 100
+# Arbitrary key so only one worker reconciles at a time
+_RECONCILE_LOCK_ID = 310031
+
+
+class LeaderboardMetric(str, enum.Enum):
+    REVENUE = "revenue"
+    ORDERS = "orders"
+    CONVERSION = "conversion"
+
+
+_entry = models.LeaderboardEntry
+_COUNTERS = ("visit_count", "order_count", "items_sold", "money_earned")
+
+
+def _increment(db: Session, product_id: int, blogger_id: int, **deltas) -> None:
+    """Add deltas to the (shop, blogger) row of the product's shop, creating it if needed"""
+    values = {counter: deltas.get(counter, 0) for counter in _COUNTERS}
+    source = select(
+        models.Product.shop_id,
+        literal(blogger_id),
+        *[literal(value) for value in values.values()]
+    ).where(models.Product.id == product_id)
+    stmt = insert(_entry).from_select(["shop_id", "blogger_id", *values], source)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_shop_blogger_leaderboard_shop_blogger",
+        set_={
+            **{counter: getattr(_entry, counter) + stmt.excluded[counter] for counter in values},
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def record_visit(db: Session, product_id: int, blogger_id: int) -> None:
+    """Mirror an Analytics.visit_count increment. The caller commits."""
+    _increment(db, product_id, blogger_id, visit_count=1)
+
+
+def record_order(db: Session, order: models.Order, sign: int = 1) -> None:
+    """Mirror the Analytics increments for a processed order, or with sign -1 their retraction. The caller commits."""
+    _increment(
+        db,
+        order.product_id,
+        order.blogger_id,
+        order_count=sign,
+        items_sold=sign * order.quantity,
+        money_earned=sign * order.quantity * order.price_per_item,
+    )
+
+
+def record_corrections(db: Session, corrections: List[dict]) -> None:
+    """
+    Mirror Analytics corrections in one statement. Each correction holds product_id,
+    blogger_id and deltas for any of the counters. The caller commits.
+    """
+    if not corrections:
+        return
+    deltas = values(
+        column("product_id", Integer),
+        column("blogger_id", Integer),
+        *[column(counter, Float if counter == "money_earned" else Integer) for counter in _COUNTERS],
+        name="deltas"
+    ).data([
+        (item["product_id"], item["blogger_id"], *[item.get(counter, 0) for counter in _COUNTERS])
+        for item in corrections
+    ])
+    # Several products of a shop may correct the same (shop, blogger) row
+    source = select(
+        models.Product.shop_id,
+        deltas.c.blogger_id,
+        *[func.sum(deltas.c[counter]) for counter in _COUNTERS]
+    )\
+        .join(models.Product, models.Product.id == deltas.c.product_id)\
+        .where(models.Product.shop_id.isnot(None))\
+        .group_by(models.Product.shop_id, deltas.c.blogger_id)
+    stmt = insert(_entry).from_select(["shop_id", "blogger_id", *_COUNTERS], source)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_shop_blogger_leaderboard_shop_blogger",
+        set_={
+            **{counter: getattr(_entry, counter) + stmt.excluded[counter] for counter in _COUNTERS},
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def top_bloggers(
+    db: Session,
+    shop_id: int,
+    metric: LeaderboardMetric,
+    limit: int = 10,
+    min_visits: int = 0
+) -> List[models.LeaderboardEntry]:
+    """
+    Read the top entries straight off the matching (shop_id, metric) index.
+    Bloggers are joined in the same query, since every entry's name is shown.
+    """
+    query = db.query(_entry)\
+        .options(joinedload(_entry.blogger))\
+        .filter(_entry.shop_id == shop_id)
+    if metric == LeaderboardMetric.REVENUE:
+        query = query.order_by(_entry.money_earned.desc())
+    elif metric == LeaderboardMetric.ORDERS:
+        query = query.order_by(_entry.order_count.desc())
+    else:
+        query = query.order_by(_entry.conversion_rate().desc().nulls_last())
+    if min_visits:
+        query = query.filter(_entry.visit_count >= min_visits)
+    return query.limit(limit).all()
+
+
+def reconcile(db: Session, shop_id: Optional[int] = None) -> int:
+    """
+    Recompute leaderboard rows from Analytics and drop rows that no longer have any.
+    Returns the number of rows written. The caller commits.
+    """
+    totals = select(
+        models.Product.shop_id,
+        models.Analytics.blogger_id,
+        func.coalesce(func.sum(models.Analytics.visit_count), 0),
+        func.coalesce(func.sum(models.Analytics.order_count), 0),
+        func.coalesce(func.sum(models.Analytics.items_sold), 0),
+        func.coalesce(func.sum(models.Analytics.money_earned), 0.0),
+    )\
+        .join(models.Product, models.Analytics.product_id == models.Product.id)\
+        .where(models.Analytics.blogger_id.isnot(None), models.Product.shop_id.isnot(None))\
+        .group_by(models.Product.shop_id, models.Analytics.blogger_id)
+    if shop_id is not None:
+        totals = totals.where(models.Product.shop_id == shop_id)
+
+    stmt = insert(_entry).from_select(["shop_id", "blogger_id", *_COUNTERS], totals)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_shop_blogger_leaderboard_shop_blogger",
+        set_={
+            **{counter: stmt.excluded[counter] for counter in _COUNTERS},
+            "updated_at": func.now(),
+        },
+    )
+    written = db.execute(stmt).rowcount
+
+    has_analytics = exists().where(
+        and_(
+            models.Analytics.blogger_id == _entry.blogger_id,
+            models.Analytics.product_id == models.Product.id,
+            models.Product.shop_id == _entry.shop_id
+        )
+    )
+    stale = delete(_entry).where(~has_analytics)
+    if shop_id is not None:
+        stale = stale.where(_entry.shop_id == shop_id)
+    db.execute(stale)
+    return written
+
+
+def reconcile_all() -> Optional[int]:
+    """Reconcile every shop unless another worker is already doing it"""
+    db = BackgroundSessionLocal()
+    try:
+        locked = db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": _RECONCILE_LOCK_ID}).scalar()
+        if not locked:
+            return None
+        written = reconcile(db)
+        db.commit()
+        return written
+    finally:
+        db.close()
+
+
+class PeriodicReconciler:
+    """Background thread that runs reconcile_all every interval seconds"""
+
+    def __init__(self, interval: float = LEADERBOARD_RECONCILE_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                reconcile_all()
+            except Exception:
+                logger.exception("Leaderboard reconciliation failed")
+
+
+reconciler = PeriodicReconciler()
@@ -0,0 +1,243 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Set
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+import asyncio
+import json
+import logging
+import os
+import select as io_select
+import threading
+import uuid
+
+from . import models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+LIVE_ANALYTICS_ENABLED = os.getenv("LIVE_ANALYTICS_ENABLED", "true").lower() in ("1", "true", "yes")
+LIVE_ANALYTICS_CHANNEL = "analytics_deltas"
+# Deltas buffered per open stream before it is told to resync
+LIVE_ANALYTICS_QUEUE_SIZE = int(os.getenv("LIVE_ANALYTICS_QUEUE_SIZE", "1000"))
+# Deltas arriving within this window are merged into one event per (product, blogger)
+LIVE_ANALYTICS_BATCH_SECONDS = float(os.getenv("LIVE_ANALYTICS_BATCH_SECONDS", "0.5"))
+LIVE_ANALYTICS_HEARTBEAT_SECONDS = float(os.getenv("LIVE_ANALYTICS_HEARTBEAT_SECONDS", "15"))
+
+COUNTERS = ("visit_count", "order_count", "items_sold", "money_earned")
+
+# Tags this worker's notifications, which are already delivered locally on commit
+_ORIGIN = uuid.uuid4().hex
+_PENDING = "live_analytics_deltas"
+
+
+def publish(db: Session, product_id: int, blogger_id: int, **deltas) -> None:
+    """
+    Announce Analytics increments made in db's transaction.
+    Other workers get them through NOTIFY, which Postgres delivers only on commit;
+    streams on this worker get them from the after_commit hook below.
+    """
+    if not LIVE_ANALYTICS_ENABLED:
+        return
+    shop_id = db.query(models.Product.shop_id).filter(models.Product.id == product_id).scalar()
+    if shop_id is None:
+        return
+    delta = {
+        "shop_id": shop_id,
+        "product_id": product_id,
+        "blogger_id": blogger_id,
+        **{counter: deltas.get(counter, 0) for counter in COUNTERS},
+    }
+    db.execute(select(func.pg_notify(LIVE_ANALYTICS_CHANNEL, json.dumps({"origin": _ORIGIN, **delta}))))
+    db.info.setdefault(_PENDING, []).append(delta)
+
+
+@event.listens_for(Session, "after_commit")
+def _fan_out_committed(session: Session) -> None:
+    for delta in session.info.pop(_PENDING, ()):
+        hub.dispatch(delta)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING, None)
+
+
+class Subscription:
+    """One open stream; lives on the event loop that serves it"""
+
+    def __init__(self, shop_id: int, product_id: Optional[int] = None, maxsize: int = LIVE_ANALYTICS_QUEUE_SIZE):
+        self.shop_id = shop_id
+        self.product_id = product_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize)
+        self.lagged = False
+
+    def push(self, delta: dict) -> None:
+        if self.product_id is not None and delta["product_id"] != self.product_id:
+            return
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class AnalyticsHub:
+    """Fans deltas out to the streams open on this worker, by shop"""
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, shop_id: int, product_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(shop_id, product_id)
+        with self._lock:
+            self._subscriptions.setdefault(shop_id, set()).add(subscription)
+        # Workers nobody streams from never hold a listening connection
+        listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.shop_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.shop_id]
+
+    def dispatch(self, delta: dict) -> None:
+        """Thread-safe; called from request threads, task workers and the listener"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(delta["shop_id"], ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, delta)
+            except RuntimeError:
+                # The loop serving this stream has shut down
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class NotificationListener:
+    """Background thread that LISTENs for deltas published by other workers"""
+
+    def __init__(self, channel: str = LIVE_ANALYTICS_CHANNEL):
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="live-analytics-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Live analytics listener lost its connection, reconnecting")
+                self._stop.wait(5)
+
+    def _listen(self) -> None:
+        connection = engine.raw_connection()
+        # Keep this long-lived connection out of the pool used by requests
+        connection.detach()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            while not self._stop.is_set():
+                if io_select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    self._handle(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+    def _handle(self, payload: str) -> None:
+        try:
+            delta = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed analytics delta: %r", payload)
+            return
+        if delta.pop("origin", None) != _ORIGIN:
+            hub.dispatch(delta)
+
+
+hub = AnalyticsHub()
+listener = NotificationListener()
+
+
+def _merge(deltas: List[dict]) -> List[dict]:
+    merged: Dict[tuple, dict] = {}
+    for delta in deltas:
+        key = (delta["product_id"], delta["blogger_id"])
+        if key not in merged:
+            merged[key] = dict(delta)
+        else:
+            for counter in COUNTERS:
+                merged[key][counter] += delta[counter]
+    return list(merged.values())
+
+
+def _event(name: str, data: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(
+    shop_id: int,
+    product_id: Optional[int] = None,
+    expires_at: Optional[datetime] = None
+) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for one shop, or one of its products. Idle streams only send a
+    comment line every heartbeat interval and never touch the database. If the client
+    falls too far behind, buffered deltas are dropped and a resync event tells it to
+    reload totals. At expires_at the stream sends an expired event and ends.
+    The subscription is made once the response starts and always dropped when it ends,
+    so a client that leaves before the first byte leaves nothing registered.
+    """
+    subscription = hub.subscribe(shop_id, product_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            timeout = LIVE_ANALYTICS_HEARTBEAT_SECONDS
+            if expires_at is not None:
+                remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+                if remaining <= 0:
+                    yield _event("expired", {"shop_id": shop_id})
+                    return
+                timeout = min(timeout, remaining)
+            try:
+                first = await asyncio.wait_for(subscription.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            await asyncio.sleep(LIVE_ANALYTICS_BATCH_SECONDS)
+            deltas = [first]
+            while not subscription.queue.empty():
+                deltas.append(subscription.queue.get_nowait())
+            if subscription.lagged:
+                subscription.lagged = False
+                yield _event("resync", {"shop_id": shop_id})
+                continue
+            at = datetime.now(timezone.utc).isoformat()
+            for delta in _merge(deltas):
+                yield _event("delta", {**delta, "at": at})
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,260 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+import asyncio
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Priority classes; a higher value is served first
+EXPENSIVE = 0
+NORMAL = 1
+CRITICAL = 2
+
+PRIORITY_NAMES = {EXPENSIVE: "expensive", NORMAL: "normal", CRITICAL: "critical"}
+
+# Requests allowed to run at once across the whole worker; 0 sizes it from the database pool
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "0"))
+# Share of MAX_IN_FLIGHT each class may occupy, keeping headroom for click paths
+CLASS_SHARES = {
+    EXPENSIVE: float(os.getenv("LOAD_SHED_EXPENSIVE_SHARE", "0.5")),
+    NORMAL: float(os.getenv("LOAD_SHED_NORMAL_SHARE", "0.8")),
+    CRITICAL: 1.0,
+}
+# How long a request of each class may wait for a slot before it is rejected
+CLASS_DEADLINES = {
+    EXPENSIVE: float(os.getenv("LOAD_SHED_EXPENSIVE_DEADLINE_SECONDS", "1")),
+    NORMAL: float(os.getenv("LOAD_SHED_NORMAL_DEADLINE_SECONDS", "2")),
+    CRITICAL: float(os.getenv("LOAD_SHED_CRITICAL_DEADLINE_SECONDS", "5")),
+}
+
+# Public click paths: affiliate link resolution and product views
+CRITICAL_ROUTES = {
+    "GET /products/{product_id}",
+    "GET /products/batch",
+    "GET /affiliate-links/{code}",
+    "GET /products/images/{key:path}",
+    "POST /analytics/visit",
+    "POST /orders/",
+}
+# Dashboard reads and exports that scan many rows
+EXPENSIVE_ROUTES = {
+    "GET /shops/{shop_id}/analytics",
+    "GET /products/{product_id}/analytics",
+    "GET /analytics/batch",
+    "GET /shops/{shop_id}/unique-visitors",
+    "GET /products/{product_id}/unique-visitors",
+    "GET /shops/{shop_id}/orders/export",
+    "GET /products/{product_id}/orders/",
+}
+
+# Long-lived streams that mostly sit idle; they would hold a slot for their whole lifetime
+UNLIMITED_ROUTES = {
+    "GET /shops/{shop_id}/analytics/stream",
+}
+
+# Per-route caps, overridable with ROUTE_CONCURRENCY_LIMITS="GET /a/{id}=4,GET /b=2"
+DEFAULT_ROUTE_LIMITS = {
+    "GET /shops/{shop_id}/orders/export": 2,
+    "GET /shops/{shop_id}/analytics": 8,
+}
+
+
+def parse_route_limits(value: Optional[str]) -> Dict[str, int]:
+    limits = dict(DEFAULT_ROUTE_LIMITS)
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        route, limit = item.rsplit("=", 1)
+        limits[route.strip()] = int(limit)
+    return limits
+
+
+ROUTE_LIMITS = parse_route_limits(os.getenv("ROUTE_CONCURRENCY_LIMITS"))
+
+
+def pool_in_flight_limit(pool_capacity: int) -> int:
+    """
+    One request per pooled connection, so an admitted request never waits for the pool.
+    The second connection each running export opens next to the one its authentication
+    uses is set aside first; work outside requests has a pool of its own.
+    """
+    exports = ROUTE_LIMITS.get("GET /shops/{shop_id}/orders/export", 0)
+    return max(pool_capacity - exports, 1)
+
+# Middleware instances, so admin endpoints can report on them
+limiters = []
+
+
+def route_template(scope) -> str:
+    """Method and path template of the route a request will hit, e.g. 'GET /products/{product_id}'"""
+    app = scope.get("app")
+    path = scope.get("path", "")
+    if app is not None:
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = route.path
+                break
+    return f"{scope.get('method', '')} {path}"
+
+
+def route_priority(route: str) -> int:
+    if route in CRITICAL_ROUTES:
+        return CRITICAL
+    if route in EXPENSIVE_ROUTES:
+        return EXPENSIVE
+    return NORMAL
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class PriorityLimiter:
+    """
+    Counting semaphore with per-priority caps and priority wake-up order.
+    Tracks a moving average of how long slots are held to estimate queueing delay,
+    so requests that cannot be served before their deadline are refused at once.
+    """
+
+    def __init__(self, capacity: int, shares: Optional[Dict[int, float]] = None):
+        self.capacity = capacity
+        self.shares = shares or {}
+        self.in_flight = 0
+        self.shed = 0
+        self.hold_seconds = 0.05
+        self._waiters: Dict[int, Deque[asyncio.Future]] = {}
+
+    def limit(self, priority: int) -> int:
+        return max(1, int(self.capacity * self.shares.get(priority, 1.0)))
+
+    def waiting(self, priority: Optional[int] = None) -> int:
+        return sum(
+            len(waiters) for waiting_priority, waiters in self._waiters.items()
+            if priority is None or waiting_priority >= priority
+        )
+
+    def estimated_wait(self, priority: int) -> float:
+        ahead = self.waiting(priority) + 1
+        return math.ceil(ahead / self.limit(priority)) * self.hold_seconds
+
+    async def acquire(self, priority: int, deadline: float) -> float:
+        """Take a slot and return the acquisition time, or raise Overloaded"""
+        if self.in_flight < self.limit(priority) and not self.waiting(priority):
+            self.in_flight += 1
+            return time.monotonic()
+
+        estimate = self.estimated_wait(priority)
+        if estimate > deadline:
+            self.shed += 1
+            raise Overloaded(estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(priority, deque())
+        waiters.append(future)
+        granted = False
+        try:
+            await asyncio.wait_for(future, deadline)
+            granted = True
+            return time.monotonic()
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise Overloaded(self.estimated_wait(priority))
+        finally:
+            if not granted:
+                if future.done() and not future.cancelled():
+                    # Granted just as we gave up; hand the slot back
+                    self.release(None)
+                elif future in waiters:
+                    waiters.remove(future)
+
+    def release(self, acquired_at: Optional[float]) -> None:
+        self.in_flight -= 1
+        if acquired_at is not None:
+            held = time.monotonic() - acquired_at
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held
+        for priority in sorted(self._waiters, reverse=True):
+            waiters = self._waiters[priority]
+            while waiters and self.in_flight < self.limit(priority):
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(True)
+                    self.in_flight += 1
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware enforcing per-route concurrency limits and a global in-flight cap.
+    Requests that would wait longer than their class deadline get 503 with Retry-After
+    instead of piling up on the database pool.
+    """
+
+    def __init__(self, app, max_in_flight: int = MAX_IN_FLIGHT, route_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.global_limiter = PriorityLimiter(max_in_flight, CLASS_SHARES)
+        self.route_limiters = {
+            route: PriorityLimiter(limit)
+            for route, limit in (ROUTE_LIMITS if route_limits is None else route_limits).items()
+        }
+        limiters.append(self)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_template(scope)
+        if route in UNLIMITED_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        priority = route_priority(route)
+        deadline = CLASS_DEADLINES[priority]
+        route_limiter = self.route_limiters.get(route)
+        started = time.monotonic()
+        held = []
+        try:
+            if route_limiter is not None:
+                held.append((route_limiter, await route_limiter.acquire(priority, deadline)))
+            remaining = max(0.0, deadline - (time.monotonic() - started))
+            held.append((self.global_limiter, await self.global_limiter.acquire(priority, remaining)))
+        except Overloaded as e:
+            for limiter, _ in held:
+                limiter.release(None)
+            logger.warning("Shedding %s (%s)", route, PRIORITY_NAMES[priority])
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+        except BaseException:
+            for limiter, _ in held:
+                limiter.release(None)
+            raise
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for limiter, acquired_at in reversed(held):
+                limiter.release(acquired_at)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.global_limiter.in_flight,
+            "waiting": self.global_limiter.waiting(),
+            "shed": self.global_limiter.shed + sum(l.shed for l in self.route_limiters.values()),
+            "capacity": self.global_limiter.capacity,
+            "estimated_hold_ms": self.global_limiter.hold_seconds * 1000,
+            "routes": {
+                route: {"in_flight": l.in_flight, "waiting": l.waiting(), "limit": l.capacity, "shed": l.shed}
+                for route, l in self.route_limiters.items()
+            },
+        }
+
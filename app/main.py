@@ -1,20 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from pathlib import Path
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from datetime import timedelta
 from typing import List
-from . import models, schemas, auth
-from .database import engine, get_db
+from . import models, schemas, auth, leaderboard, analytics_tasks, live_analytics
+from .query_stats import current_route
+from .load_shedding import MAX_IN_FLIGHT, LoadSheddingMiddleware, pool_in_flight_limit, route_template
+from .deadlines import ClientDisconnected, QueryDeadlineMiddleware, deadline_response
+from .tasks import task_queue
+from .unique_visitors import visitor_fingerprint
+from .batching import InvalidBatch, in_request_order, parse_ids
+from .fieldsets import FieldSet, selectable
+from .projections import projection
+from .click_log import click_writer, event_from_request, SOURCE_PRODUCT_VIEW
+from .database import POOL_CAPACITY, engine, get_db, get_read_db, remember_write
 from sqlalchemy import and_, func
+from sqlalchemy.exc import OperationalError
 from .routers import shops, products, affiliate_links, bloggers, admin
 
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="DeltaHub API")
 
+# Per-route statement deadlines; expensive reads stop their queries when the client leaves
+app.add_middleware(QueryDeadlineMiddleware)
+
+# Refuse work early when the worker is saturated instead of queueing on the DB pool;
+# task workers each hold a pooled connection while they run
+app.add_middleware(
+    LoadSheddingMiddleware,
+    max_in_flight=MAX_IN_FLIGHT or pool_in_flight_limit(POOL_CAPACITY)
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +58,63 @@ app.add_middleware(
     max_age=3600  # Cache preflight requests for 1 hour
 )
 
+# Tag queries with the route that issued them for the slow-query log
+@app.middleware("http")
+async def tag_queries_with_route(request: Request, call_next):
+    token = current_route.set(route_template(request.scope))
+    try:
+        return await call_next(request)
+    finally:
+        current_route.reset(token)
+
+# Keep clients that just wrote on the primary so they read their own writes
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        remember_write(request)
+    return response
+
+# Statements stopped by their deadline answer 504 instead of 500
+@app.exception_handler(OperationalError)
+@app.exception_handler(ClientDisconnected)
+async def handle_cancelled_query(request: Request, exc: Exception):
+    response = deadline_response(request, exc)
+    if response is None:
+        raise exc
+    return response
+
+# Background writer for the click event log
+@app.on_event("startup")
+def start_click_writer():
+    click_writer.start()
+
+@app.on_event("shutdown")
+def stop_click_writer():
+    click_writer.stop()
+
+# Workers for deferred side effects
+@app.on_event("startup")
+def start_task_queue():
+    task_queue.start()
+
+@app.on_event("shutdown")
+def stop_task_queue():
+    task_queue.stop()
+
+# The live analytics listener starts with the first stream; close its connection on exit
+@app.on_event("shutdown")
+def stop_live_analytics_listener():
+    live_analytics.listener.stop()
+
+# Periodic leaderboard reconciliation against Analytics
+@app.on_event("startup")
+def start_leaderboard_reconciler():
+    leaderboard.reconciler.start()
+
+@app.on_event("shutdown")
+def stop_leaderboard_reconciler():
+    leaderboard.reconciler.stop()
 
 # Include routers
 app.include_router(shops.router)
@@ -90,7 +168,7 @@ def create_product(
 def get_products(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_shop: models.Shop = Depends(auth.get_current_shop)
 ):
     products = db.query(models.Product)\
@@ -112,7 +190,8 @@ def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
 @app.get("/products/{product_id}/orders/", response_model=List[schemas.Order])
 def get_product_orders(
     product_id: int,
-    db: Session = Depends(get_db),
+    fields: FieldSet | None = Depends(selectable(schemas.Order)),
+    db: Session = Depends(get_read_db),
     current_shop: models.Shop = Depends(auth.get_current_shop)
 ):
     product = db.query(models.Product)\
@@ -120,7 +199,14 @@ def get_product_orders(
         .first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return db.query(models.Order).filter(models.Order.product_id == product_id).all()
+    if fields:
+        query = db.query(models.Order)\
+            .filter(models.Order.product_id == product_id)\
+            .options(*fields.load_options(models.Order))
+        return fields.render(query.all())
+    
+    rows = projection(models.Order, schemas.Order)
+    return rows.rows(db.execute(rows.select().where(models.Order.product_id == product_id)))
 
 @app.put("/orders/{order_id}/status")
 def update_order_status(
@@ -141,58 +227,73 @@ def update_order_status(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    was_processed = order.status == models.OrderStatus.PROCESSED
     order.status = status
+    db.commit()
     
     if status == models.OrderStatus.PROCESSED:
-        # Update analytics
-        analytics = db.query(models.Analytics)\
-            .filter(
-                and_(
-                    models.Analytics.product_id == order.product_id,
-                    models.Analytics.blogger_id == order.blogger_id
-                )
-            ).first()
-        
-        if analytics:
-            analytics.order_count += 1
-            analytics.items_sold += order.quantity
-            analytics.money_earned += (order.quantity * order.price_per_item)
+        task_queue.defer("apply_processed_order", order_id=order.id)
+    elif was_processed:
+        # Its counters and earnings were added when it was processed
+        task_queue.defer("retract_cancelled_order", order_id=order.id)
     
-    db.commit()
     return {"status": "success"}
 
 # Analytics endpoints
+@app.get("/analytics/batch", response_model=schemas.AnalyticsBatch)
+def get_analytics_batch(
+    product_ids: List[str] = Query(..., description="Product ids, comma-separated or repeated"),
+    fields: FieldSet | None = Depends(selectable(schemas.Analytics)),
+    db: Session = Depends(get_read_db),
+    current_shop: models.Shop = Depends(auth.get_current_shop)
+):
+    """
+    Get analytics of many products in one query, in the order they were requested.
+    Products that do not exist or belong to another shop are listed in missing.
+    """
+    try:
+        ids = parse_ids(product_ids)
+    except InvalidBatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    options = fields.load_options(models.Analytics) if fields else [joinedload(models.Analytics.blogger)]
+    rows = db.query(models.Product.id, models.Analytics)\
+        .outerjoin(models.Analytics, models.Analytics.product_id == models.Product.id)\
+        .options(*options)\
+        .filter(models.Product.id.in_(ids), models.Product.shop_id == current_shop.id)\
+        .order_by(models.Product.id, models.Analytics.id)\
+        .all()
+    
+    found = {}
+    for product_id, analytics in rows:
+        entries = found.setdefault(product_id, {"product_id": product_id, "analytics": []})
+        if analytics is not None:
+            entries["analytics"].append(fields.dump(analytics) if fields else analytics)
+    
+    items, missing = in_request_order(ids, found)
+    if fields:
+        return JSONResponse({"items": items, "missing": missing})
+    return {"items": items, "missing": missing}
+
 @app.post("/analytics/visit")
 def record_visit(
     product_id: int,
     blogger_id: int,
-    db: Session = Depends(get_db)
+    request: Request
 ):
-    analytics = db.query(models.Analytics)\
-        .filter(
-            and_(
-                models.Analytics.product_id == product_id,
-                models.Analytics.blogger_id == blogger_id
-            )
-        ).first()
-    
-    if analytics:
-        analytics.visit_count += 1
-    else:
-        analytics = models.Analytics(
-            product_id=product_id,
-            blogger_id=blogger_id,
-            visit_count=1
-        )
-        db.add(analytics)
-    
-    db.commit()
+    task_queue.defer(
+        "record_visit",
+        product_id=product_id,
+        blogger_id=blogger_id,
+        fingerprint=visitor_fingerprint(request)
+    )
+    click_writer.submit(event_from_request(request, SOURCE_PRODUCT_VIEW, product_id, blogger_id))
     return {"status": "success"}
 
 @app.get("/products/{product_id}/analytics", response_model=List[schemas.Analytics])
 def get_product_analytics(
     product_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_shop: models.Shop = Depends(auth.get_current_shop)
 ):
     product = db.query(models.Product)\
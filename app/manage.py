@@ -0,0 +1,336 @@
+"""
+Maintenance commands.
+
+Usage:
+    python -m app.manage <command> [options]
+"""
+from datetime import date, datetime, timedelta, timezone
+import argparse
+import json
+import sys
+
+from sqlalchemy import Integer, and_, column, exists, func, select, tuple_, update, values
+
+from . import models, leaderboard, order_partitions, analytics_reconciliation, blogger_earnings
+from .click_log import VISIT_SOURCES
+from .image_storage import image_storage, key_from_url
+from .database import SessionLocal, engine
+
+
+def rebuild_visit_counts(chunk_size: int = 5000, zero_missing: bool = False, overwrite: bool = False) -> dict:
+    """
+    Recompute Analytics.visit_count from the click event log.
+    Per-pair counts are aggregated in the database and streamed back through a
+    server-side cursor, so memory stays bounded by chunk_size.
+
+    The log only holds visits made since it was introduced and not yet dropped with
+    its partitions, so by default a counter is only raised to the logged count, never
+    lowered. overwrite sets counters to the logged count exactly, which discards
+    visits counted before the log covered them.
+    """
+    event = models.ClickEvent
+    analytics = models.Analytics
+    counts = select(event.product_id, event.blogger_id, func.count())\
+        .where(
+            event.source.in_(VISIT_SOURCES),
+            event.product_id.isnot(None),
+            event.blogger_id.isnot(None)
+        )\
+        .group_by(event.product_id, event.blogger_id)
+
+    stats = {"pairs": 0, "updated": 0, "created": 0, "zeroed": 0}
+    with engine.connect() as reader:
+        result = reader.execution_options(stream_results=True, yield_per=chunk_size).execute(counts)
+        for chunk in result.partitions():
+            visits = {(product_id, blogger_id): count for product_id, blogger_id, count in chunk}
+            stats["pairs"] += len(visits)
+            db = SessionLocal()
+            try:
+                logged = values(
+                    column("product_id", Integer),
+                    column("blogger_id", Integer),
+                    column("visit_count", Integer),
+                    name="logged"
+                ).data([(product_id, blogger_id, count) for (product_id, blogger_id), count in visits.items()])
+                rebuilt = logged.c.visit_count if overwrite else func.greatest(
+                    func.coalesce(analytics.visit_count, 0), logged.c.visit_count
+                )
+                # Set in SQL, so visits counted while the chunk runs are not overwritten by a stale read
+                updated = db.execute(
+                    update(analytics)
+                    .where(
+                        analytics.product_id == logged.c.product_id,
+                        analytics.blogger_id == logged.c.blogger_id,
+                        analytics.visit_count.is_distinct_from(rebuilt)
+                    )
+                    .values(visit_count=rebuilt)
+                ).rowcount
+                existing = db.query(analytics.product_id, analytics.blogger_id)\
+                    .filter(tuple_(analytics.product_id, analytics.blogger_id).in_(list(visits)))\
+                    .all()
+                missing = visits.keys() - {(row.product_id, row.blogger_id) for row in existing}
+                db.bulk_insert_mappings(analytics, [
+                    {
+                        "product_id": product_id,
+                        "blogger_id": blogger_id,
+                        "visit_count": visits[(product_id, blogger_id)],
+                        "order_count": 0,
+                        "items_sold": 0,
+                        "money_earned": 0.0
+                    }
+                    for product_id, blogger_id in missing
+                ])
+                db.commit()
+                stats["updated"] += updated
+                stats["created"] += len(missing)
+            finally:
+                db.close()
+
+    if zero_missing:
+        # Only safe once the log covers the whole history of visits
+        logged = exists().where(
+            and_(
+                event.product_id == models.Analytics.product_id,
+                event.blogger_id == models.Analytics.blogger_id,
+                event.source.in_(VISIT_SOURCES)
+            )
+        )
+        with engine.begin() as connection:
+            result = connection.execute(
+                update(models.Analytics)
+                .where(models.Analytics.visit_count != 0, ~logged)
+                .values(visit_count=0)
+            )
+            stats["zeroed"] = result.rowcount
+    return stats
+
+
+def collect_image_garbage(grace_seconds: float = 86400, dry_run: bool = False) -> dict:
+    """
+    Delete stored images that no Product.image_url references, and spool files left by
+    uploads that failed part way. Files younger than grace_seconds are kept, so an image
+    uploaded just before the product that uses it is saved is not lost and uploads still
+    in progress are not touched; uploads that hit an existing file refresh it.
+    """
+    db = SessionLocal()
+    try:
+        referenced = {
+            key_from_url(image_url)
+            for (image_url,) in db.query(models.Product.image_url)
+                .filter(models.Product.image_url.isnot(None))
+                .yield_per(5000)
+        }
+    finally:
+        db.close()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    stats = {"files": 0, "referenced": 0, "recent": 0, "deleted": 0, "spool_files": 0}
+    for key, modified in image_storage.keys():
+        stats["files"] += 1
+        if key in referenced:
+            stats["referenced"] += 1
+        elif modified > cutoff:
+            stats["recent"] += 1
+        else:
+            if not dry_run:
+                image_storage.delete(key)
+            stats["deleted"] += 1
+
+    for path, modified in image_storage.spool_files():
+        if modified > cutoff:
+            continue
+        if not dry_run:
+            path.unlink(missing_ok=True)
+        stats["spool_files"] += 1
+    return stats
+
+
+def write_payout_statements(month: date, path: str) -> dict:
+    """Write every blogger's statement for month to path as NDJSON, one statement per line"""
+    stats = {"statements": 0, "money_earned": 0.0}
+    with open(path, "w", encoding="utf-8") as output:
+        for statement in blogger_earnings.payout_statements(month):
+            output.write(json.dumps(statement) + "\n")
+            stats["statements"] += 1
+            stats["money_earned"] += statement["money_earned"]
+    return stats
+
+
+def _month(value: str) -> date:
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser(
+        "rebuild-visit-counts",
+        help="Recompute Analytics.visit_count from click_events"
+    )
+    rebuild.add_argument("--chunk-size", type=int, default=5000)
+    rebuild.add_argument(
+        "--zero-missing",
+        action="store_true",
+        help="Reset counters of pairs with no logged visits; requires --overwrite"
+    )
+    rebuild.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Set counters to the logged count even when that is lower (only when the log covers all history)"
+    )
+
+    reconcile = commands.add_parser(
+        "reconcile-leaderboard",
+        help="Recompute shop blogger leaderboards from Analytics"
+    )
+    reconcile.add_argument("--shop-id", type=int, default=None)
+
+    reconcile_orders = commands.add_parser(
+        "reconcile-order-analytics",
+        help="Recompute Analytics order counters from orders and correct the pairs that drifted"
+    )
+    reconcile_orders.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only recheck pairs with orders changed since the last run"
+    )
+    reconcile_orders.add_argument(
+        "--products-per-batch",
+        type=int,
+        default=analytics_reconciliation.RECONCILE_PRODUCTS_PER_BATCH
+    )
+    reconcile_orders.add_argument(
+        "--pairs-per-batch",
+        type=int,
+        default=analytics_reconciliation.RECONCILE_PAIRS_PER_BATCH
+    )
+    reconcile_orders.add_argument("--dry-run", action="store_true", help="Only report drift")
+
+    earnings = commands.add_parser(
+        "rebuild-blogger-earnings",
+        help="Recompute blogger earnings by shop and month from processed orders"
+    )
+    earnings.add_argument(
+        "--since",
+        type=_month,
+        default=None,
+        help="First month to rebuild, YYYY-MM (default: the oldest order still in the table)"
+    )
+
+    payouts = commands.add_parser(
+        "payout-statements",
+        help="Write every blogger's earnings statement for a month as NDJSON"
+    )
+    payouts.add_argument("--month", type=_month, required=True, help="YYYY-MM")
+    payouts.add_argument("--output", default=None, help="Default: payout-statements-YYYYMM.ndjson")
+
+    partitions = commands.add_parser(
+        "create-order-partitions",
+        help="Create monthly orders partitions ahead of time"
+    )
+    partitions.add_argument("--months-ahead", type=int, default=order_partitions.ORDER_PARTITION_MONTHS_AHEAD)
+
+    archive = commands.add_parser(
+        "archive-order-partitions",
+        help="Export orders partitions past the retention window to gzipped CSV and detach them"
+    )
+    archive.add_argument("--retention-months", type=int, default=order_partitions.ORDER_RETENTION_MONTHS)
+    archive.add_argument("--directory", default=order_partitions.ORDER_ARCHIVE_DIR)
+    archive.add_argument("--drop", action="store_true", help="Drop partitions once they are detached")
+    archive.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be archived")
+
+    gc_images = commands.add_parser(
+        "gc-images",
+        help="Delete stored product images that no product references"
+    )
+    gc_images.add_argument(
+        "--grace-seconds",
+        type=float,
+        default=86400,
+        help="Keep unreferenced files modified more recently than this"
+    )
+    gc_images.add_argument("--dry-run", action="store_true", help="Only count the files that would be deleted")
+
+    args = parser.parse_args(argv)
+    if args.command == "rebuild-visit-counts":
+        if args.zero_missing and not args.overwrite:
+            parser.error("--zero-missing discards visits the log does not cover; pass --overwrite as well")
+        stats = rebuild_visit_counts(args.chunk_size, args.zero_missing, args.overwrite)
+        print(
+            f"Rebuilt {stats['pairs']} pairs: {stats['updated']} updated, "
+            f"{stats['created']} created, {stats['zeroed']} zeroed"
+        )
+    elif args.command == "reconcile-leaderboard":
+        db = SessionLocal()
+        try:
+            written = leaderboard.reconcile(db, args.shop_id)
+            db.commit()
+        finally:
+            db.close()
+        print(f"Reconciled {written} leaderboard entries")
+    elif args.command == "reconcile-order-analytics":
+        stats = analytics_reconciliation.reconcile_order_counters(
+            incremental=args.incremental,
+            products_per_batch=args.products_per_batch,
+            pairs_per_batch=args.pairs_per_batch,
+            dry_run=args.dry_run
+        )
+        since = f" since {stats['since'].isoformat()}" if stats["since"] else ""
+        print(f"{stats['mode'].capitalize()} run{since}, {stats['batches']} batches")
+        print(
+            f"{stats['drifted']} pairs drifted: {stats['updated']} updated, {stats['created']} created"
+            + (" (dry run, nothing written)" if args.dry_run else "")
+        )
+        print(
+            f"Absolute drift: {stats['order_count']} orders, {stats['items_sold']} items, "
+            f"{stats['money_earned']:.2f} money_earned (net {stats['net_money_earned']:+.2f})"
+        )
+        if stats["lost"]:
+            print(f"{stats['lost']} processed orders whose task was lost {'would be' if args.dry_run else 'were'} counted")
+        if stats["retracted"]:
+            print(f"{stats['retracted']} cancelled orders whose task was lost {'would be' if args.dry_run else 'were'} retracted")
+        if stats["max_money_drift_pair"]:
+            product_id, blogger_id = stats["max_money_drift_pair"]
+            print(f"Largest money drift: {stats['max_money_drift']:.2f} on product {product_id}, blogger {blogger_id}")
+    elif args.command == "rebuild-blogger-earnings":
+        db = SessionLocal()
+        try:
+            written = blogger_earnings.rebuild(db, args.since)
+            db.commit()
+        finally:
+            db.close()
+        print(f"Rebuilt {written} blogger earnings rows")
+    elif args.command == "payout-statements":
+        output = args.output or f"payout-statements-{args.month:%Y%m}.ndjson"
+        stats = write_payout_statements(args.month, output)
+        print(f"Wrote {stats['statements']} statements totalling {stats['money_earned']:.2f} to {output}")
+    elif args.command == "create-order-partitions":
+        created = order_partitions.ensure_partitions(args.months_ahead)
+        print(f"Created {len(created)} orders partitions" + (f": {', '.join(created)}" if created else ""))
+        stray = order_partitions.default_partition_rows()
+        if stray:
+            print(f"Warning: {stray} orders are in {order_partitions.DEFAULT_PARTITION}; move them to monthly partitions")
+    elif args.command == "archive-order-partitions":
+        archived = order_partitions.archive_partitions(
+            args.retention_months, args.directory, args.drop, args.dry_run
+        )
+        for item in archived:
+            rows = "" if item["rows"] is None else f" ({item['rows']} rows)"
+            print(f"{item['partition']}{rows} -> {item['file']}")
+        print(f"{'Would archive' if args.dry_run else 'Archived'} {len(archived)} orders partitions")
+    elif args.command == "gc-images":
+        stats = collect_image_garbage(args.grace_seconds, args.dry_run)
+        print(
+            f"{stats['files']} files: {stats['referenced']} referenced, {stats['recent']} too recent, "
+            f"{stats['deleted']} {'would be deleted' if args.dry_run else 'deleted'}; "
+            f"{stats['spool_files']} abandoned upload files {'would be removed' if args.dry_run else 'removed'}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
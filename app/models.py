@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Enum as SQLEnum, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Text, Identity, String, Float, ForeignKey, Enum as SQLEnum, DateTime, Date, LargeBinary, UniqueConstraint, PrimaryKeyConstraint, Sequence, Index, cast, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 import enum
 from .database import Base
@@ -33,12 +34,20 @@ class Product(Base):
     image_url = Column(String, nullable=True)  # URL to the uploaded image
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Maintained by PostgreSQL for full-text search; only loaded when asked for
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'B')",
+        persisted=True
+    )))
 
     shop = relationship("Shop", back_populates="products")
     orders = relationship("Order", back_populates="product")
     analytics = relationship("Analytics", back_populates="product")
     affiliate_links = relationship("AffiliateLink", back_populates="product")
 
+Index("ix_products_search_vector", Product.search_vector, postgresql_using="gin")
+
 class Blogger(Base):
     __tablename__ = "bloggers"
 
@@ -54,21 +63,42 @@ class Blogger(Base):
     affiliate_links = relationship("AffiliateLink", back_populates="blogger")
 
 class Order(Base):
+    """
+    Range-partitioned by month of created_at; partitions are managed by app.order_partitions.
+    The table's primary key includes created_at, but rows are still identified by id alone.
+    """
     __tablename__ = "orders"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, Sequence("orders_id_seq"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     blogger_id = Column(Integer, ForeignKey("bloggers.id"))
     quantity = Column(Integer)
     price_per_item = Column(Float)
     client_phone = Column(String)
     status = Column(SQLEnum(OrderStatus), default=OrderStatus.WAITING)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Stamped by every status change; indexed for incremental analytics reconciliation
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), index=True)
+    # Set once the processed order has been added to Analytics, the leaderboard and
+    # blogger earnings, by its apply_processed_order task or by reconciliation
+    counted = Column(Boolean, nullable=False, default=False, server_default="false")
 
     product = relationship("Product", back_populates="orders")
     blogger = relationship("Blogger", back_populates="orders")
 
+    __mapper_args__ = {"primary_key": [id]}
+
+# Processed orders whose task has not run yet, for reconciliation to find lost ones quickly
+Index(
+    "ix_orders_uncounted",
+    Order.product_id,
+    postgresql_where=(Order.status == OrderStatus.PROCESSED) & ~Order.counted
+)
+
 class Analytics(Base):
     __tablename__ = "analytics"
 
@@ -96,4 +126,128 @@ class AffiliateLink(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     product = relationship("Product", back_populates="affiliate_links")
-    blogger = relationship("Blogger", back_populates="affiliate_links")
\ No newline at end of file
+    blogger = relationship("Blogger", back_populates="affiliate_links")
+
+class VisitorSketch(Base):
+    """HyperLogLog sketch of unique visitors for one affiliate pair on one day"""
+    __tablename__ = "visitor_sketches"
+    __table_args__ = (
+        UniqueConstraint("product_id", "blogger_id", "day", name="uq_visitor_sketches_product_blogger_day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
+    blogger_id = Column(Integer, ForeignKey("bloggers.id"))
+    day = Column(Date, nullable=False)
+    registers = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ClickEvent(Base):
+    """
+    Append-only log of product views and affiliate link resolutions.
+    Range-partitioned by day; rows are written in batches by app.click_log.
+    """
+    __tablename__ = "click_events"
+    __table_args__ = {"postgresql_partition_by": "RANGE (occurred_at)"}
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    occurred_at = Column(DateTime(timezone=True), primary_key=True)
+    source = Column(String, nullable=False)
+    product_id = Column(Integer, index=True)
+    blogger_id = Column(Integer)
+    link_code = Column(String)
+    referrer = Column(String)
+    user_agent_hash = Column(String)
+
+class LeaderboardEntry(Base):
+    """
+    Per-shop rollup of Analytics by blogger, kept in step with it incrementally.
+    The indexes let a shop's top bloggers be read without touching the others.
+    """
+    __tablename__ = "shop_blogger_leaderboard"
+    __table_args__ = (
+        UniqueConstraint("shop_id", "blogger_id", name="uq_shop_blogger_leaderboard_shop_blogger"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
+    blogger_id = Column(Integer, ForeignKey("bloggers.id"), nullable=False)
+    visit_count = Column(Integer, nullable=False, default=0)
+    order_count = Column(Integer, nullable=False, default=0)
+    items_sold = Column(Integer, nullable=False, default=0)
+    money_earned = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    blogger = relationship("Blogger")
+
+    @classmethod
+    def conversion_rate(cls):
+        return (cast(cls.order_count, Float) / cast(func.nullif(cls.visit_count, 0), Float)).self_group()
+
+Index("ix_shop_blogger_leaderboard_revenue", LeaderboardEntry.shop_id, LeaderboardEntry.money_earned.desc())
+Index("ix_shop_blogger_leaderboard_orders", LeaderboardEntry.shop_id, LeaderboardEntry.order_count.desc())
+Index(
+    "ix_shop_blogger_leaderboard_conversion",
+    LeaderboardEntry.shop_id,
+    LeaderboardEntry.conversion_rate().desc().nulls_last()
+)
+
+class BloggerEarnings(Base):
+    """
+    What a blogger earned at one shop in one month (of the orders' created_at, UTC).
+    Incremented as orders are processed; app.blogger_earnings.rebuild recomputes it.
+    """
+    __tablename__ = "blogger_earnings"
+    __table_args__ = (
+        UniqueConstraint("blogger_id", "shop_id", "month", name="uq_blogger_earnings_blogger_shop_month"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    blogger_id = Column(Integer, ForeignKey("bloggers.id"), nullable=False)
+    shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
+    month = Column(Date, nullable=False)
+    order_count = Column(Integer, nullable=False, default=0)
+    items_sold = Column(Integer, nullable=False, default=0)
+    money_earned = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Payout statements read a whole month in blogger order
+Index("ix_blogger_earnings_month", BloggerEarnings.month, BloggerEarnings.blogger_id, BloggerEarnings.shop_id)
+
+class DeferredTask(Base):
+    """Queued side effect, used when the task queue runs in durable mode"""
+    __tablename__ = "deferred_tasks"
+
+    id = Column(BigInteger, primary_key=True)
+    name = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending", server_default="pending")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(Text)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+Index("ix_deferred_tasks_pending", DeferredTask.status, DeferredTask.run_after, DeferredTask.id)
+
+class ArchivedOrderTotals(Base):
+    """
+    Processed orders per (product, blogger) in orders partitions that were archived.
+    Written when a partition is detached, so reconciliation can still add them to the
+    orders that remain attached.
+    """
+    __tablename__ = "archived_order_totals"
+
+    product_id = Column(Integer, primary_key=True)
+    blogger_id = Column(Integer, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    items_sold = Column(Integer, nullable=False, default=0)
+    money_earned = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class JobCheckpoint(Base):
+    """Where an incremental maintenance job should resume from"""
+    __tablename__ = "job_checkpoints"
+
+    name = Column(String, primary_key=True)
+    checkpoint = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,100 @@
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import csv
+import enum
+import io
+import json
+
+from . import models
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIRST_CHUNK_SIZE = 50
+
+EXPORT_COLUMNS = (
+    models.Order.id,
+    models.Order.product_id,
+    models.Order.blogger_id,
+    models.Order.quantity,
+    models.Order.price_per_item,
+    models.Order.client_phone,
+    models.Order.status,
+    models.Order.created_at,
+    models.Order.updated_at,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def shop_orders_query(
+    shop_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    order_status: Optional[models.OrderStatus] = None
+):
+    query = select(*EXPORT_COLUMNS)\
+        .join(models.Product, models.Order.product_id == models.Product.id)\
+        .where(models.Product.shop_id == shop_id)
+    if start_date:
+        query = query.where(models.Order.created_at >= start_date)
+    if end_date:
+        # end_date is inclusive
+        query = query.where(models.Order.created_at < end_date + timedelta(days=1))
+    if order_status:
+        query = query.where(models.Order.status == order_status)
+    return query.order_by(models.Order.id)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _serialize(rows, export_format: ExportFormat) -> str:
+    if export_format == ExportFormat.CSV:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([[_plain(value) for value in row] for row in rows])
+        return buffer.getvalue()
+    return "".join(
+        json.dumps({field: _plain(value) for field, value in zip(EXPORT_FIELDS, row)}) + "\n"
+        for row in rows
+    )
+
+
+def stream_orders(open_session: Callable[[], Session], query, export_format: ExportFormat) -> Iterator[str]:
+    """
+    Serialize orders chunk by chunk from a server-side cursor.
+    The session is opened only once the body is being read and closed when the stream
+    ends or the client goes away, so a response that is never sent holds no connection.
+    """
+    if export_format == ExportFormat.CSV:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(EXPORT_FIELDS)
+        # Send the header before the query runs so the client sees bytes at once
+        yield buffer.getvalue()
+
+    db = open_session()
+    try:
+        result = db.execute(query.execution_options(stream_results=True, max_row_buffer=EXPORT_CHUNK_SIZE))
+        # A small first chunk gets rows to the client without waiting for a full one
+        first = result.fetchmany(EXPORT_FIRST_CHUNK_SIZE)
+        if first:
+            yield _serialize(first, export_format)
+        for chunk in result.partitions(EXPORT_CHUNK_SIZE):
+            yield _serialize(chunk, export_format)
+    finally:
+        db.close()
@@ -0,0 +1,186 @@
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+import gzip
+import logging
+import os
+import re
+
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions kept ready ahead of the current month
+ORDER_PARTITION_MONTHS_AHEAD = int(os.getenv("ORDER_PARTITION_MONTHS_AHEAD", "3"))
+# Months of orders kept attached; older partitions may be archived
+ORDER_RETENTION_MONTHS = int(os.getenv("ORDER_RETENTION_MONTHS", "24"))
+ORDER_ARCHIVE_DIR = os.getenv("ORDER_ARCHIVE_DIR", "archive/orders")
+
+DEFAULT_PARTITION = "orders_default"
+_PARTITION_NAME = re.compile(r"^orders_(\d{4})(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"orders_{month:%Y%m}"
+
+
+def ensure_partition(cursor, month: date) -> bool:
+    """
+    Create the monthly partition starting at month; returns False if it already exists.
+    Orders of that month already caught by the default partition would make
+    CREATE TABLE ... PARTITION OF fail, so the table is built on its own, those
+    orders are moved into it, and only then is it attached.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cursor.fetchone()[0]:
+        return False
+    next_month = add_months(month, 1)
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end = datetime(next_month.year, next_month.month, 1, tzinfo=timezone.utc)
+    cursor.execute(f"CREATE TABLE {name} (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (DEFAULT_PARTITION,))
+    if cursor.fetchone()[0]:
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            (start, end)
+        )
+        if cursor.rowcount:
+            logger.info("Moved %d orders from %s to %s", cursor.rowcount, DEFAULT_PARTITION, name)
+    cursor.execute(
+        f"ALTER TABLE orders ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    return True
+
+
+def ensure_partitions(months_ahead: int = ORDER_PARTITION_MONTHS_AHEAD, since: Optional[date] = None) -> List[str]:
+    """
+    Create monthly partitions from since (default: this month) through months_ahead months from now,
+    plus the default partition that catches rows outside them. Returns the names created.
+    """
+    current = month_start(datetime.now(timezone.utc).date())
+    month = month_start(since) if since else current
+    last = add_months(current, months_ahead)
+    created = []
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF orders DEFAULT")
+            while month <= last:
+                if ensure_partition(cursor, month):
+                    created.append(partition_name(month))
+                month = add_months(month, 1)
+        connection.commit()
+    finally:
+        connection.close()
+    return created
+
+
+def list_partitions(cursor) -> List[Tuple[str, date]]:
+    """Monthly partitions currently attached to orders, oldest first"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'orders'::regclass"
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def default_partition_rows() -> int:
+    """Rows that landed in the default partition because their month had no partition"""
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (DEFAULT_PARTITION,))
+            if not cursor.fetchone()[0]:
+                return 0
+            cursor.execute(f"SELECT count(*) FROM {DEFAULT_PARTITION}")
+            return cursor.fetchone()[0]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def record_archived_totals(cursor, name: str) -> None:
+    """
+    Add the processed orders of partition name to archived_order_totals, so analytics
+    reconciliation keeps counting them once the partition is detached
+    """
+    cursor.execute(f"""
+        INSERT INTO archived_order_totals (product_id, blogger_id, order_count, items_sold, money_earned)
+        SELECT product_id, blogger_id, COUNT(*), COALESCE(SUM(quantity), 0),
+               COALESCE(SUM(quantity * price_per_item), 0)
+        FROM {name}
+        WHERE status = 'PROCESSED' AND counted AND product_id IS NOT NULL AND blogger_id IS NOT NULL
+        GROUP BY product_id, blogger_id
+        ON CONFLICT (product_id, blogger_id) DO UPDATE SET
+            order_count = archived_order_totals.order_count + excluded.order_count,
+            items_sold = archived_order_totals.items_sold + excluded.items_sold,
+            money_earned = archived_order_totals.money_earned + excluded.money_earned,
+            updated_at = now()
+    """)
+
+
+def archive_partitions(
+    retention_months: int = ORDER_RETENTION_MONTHS,
+    directory: str = ORDER_ARCHIVE_DIR,
+    drop: bool = False,
+    dry_run: bool = False
+) -> List[dict]:
+    """
+    Export every partition that ended more than retention_months ago to a gzipped CSV
+    file and detach it from orders. Each partition is handled in its own transaction:
+    writes are blocked while it is copied, and it is only detached once the file is
+    safely on disk. Its processed orders are added to archived_order_totals in the same
+    transaction as the detach. Detached tables are kept unless drop is set.
+    """
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -retention_months)
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            closed = [(name, month) for name, month in list_partitions(cursor) if add_months(month, 1) <= cutoff]
+        connection.rollback()
+        for name, month in closed:
+            path = os.path.join(directory, f"{name}.csv.gz")
+            if dry_run:
+                archived.append({"partition": name, "file": path, "rows": None})
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {name} IN SHARE MODE")
+                cursor.execute(f"SELECT count(*) FROM {name}")
+                rows = cursor.fetchone()[0]
+                partial = path + ".partial"
+                with gzip.open(partial, "wb") as archive:
+                    cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+                with open(partial, "rb") as archive:
+                    os.fsync(archive.fileno())
+                os.replace(partial, path)
+                record_archived_totals(cursor, name)
+                cursor.execute(f"ALTER TABLE orders DETACH PARTITION {name}")
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+            connection.commit()
+            logger.info("Archived %s (%d rows) to %s", name, rows, path)
+            archived.append({"partition": name, "file": path, "rows": rows})
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return archived
@@ -0,0 +1,95 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import Float, String, cast, func, literal, or_, select, tuple_
+from sqlalchemy.orm import Session
+import base64
+import re
+
+from . import models
+
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_TERMS = 8
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+def prefix_tsquery(q: str) -> str:
+    """Turn free text into a tsquery matching every term as a prefix"""
+    terms = _TERM.findall(q.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise InvalidSearch("Search query must contain letters or digits")
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def encode_cursor(score: float, product_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{score!r}:{product_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        score, product_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(score), int(product_id)
+    except ValueError:
+        raise InvalidSearch("Invalid cursor")
+
+
+def search_products(
+    db: Session,
+    q: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    shop_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None
+) -> Tuple[List[Tuple[models.Product, float]], Optional[str]]:
+    """
+    Rank products by full-text relevance plus trigram similarity of the name.
+    Prefix matches come from the tsvector index, typos from the pg_trgm indexes.
+    Pages are keyed on (score, id) instead of OFFSET, so they stay stable while paging.
+    """
+    product = models.Product
+    tsquery = func.to_tsquery("simple", prefix_tsquery(q))
+    description = func.coalesce(product.description, "")
+    search_text = literal(q, String)
+
+    # Cast to double precision so the score survives the round trip through the cursor
+    score = cast(
+        func.ts_rank_cd(product.search_vector, tsquery)
+        + func.word_similarity(search_text, product.name)
+        + 0.5 * func.word_similarity(search_text, description),
+        Float
+    ).label("score")
+
+    matches = select(product.id, score)\
+        .where(
+            or_(
+                product.search_vector.op("@@")(tsquery),
+                search_text.op("<%")(product.name),
+                search_text.op("<%")(product.description)
+            )
+        )
+    if shop_id is not None:
+        matches = matches.where(product.shop_id == shop_id)
+    if min_price is not None:
+        matches = matches.where(product.price >= min_price)
+    if max_price is not None:
+        matches = matches.where(product.price <= max_price)
+    matches = matches.subquery()
+
+    page = select(product, matches.c.score)\
+        .join(matches, matches.c.id == product.id)
+    if cursor:
+        last_score, last_id = decode_cursor(cursor)
+        page = page.where(tuple_(matches.c.score, matches.c.id) < tuple_(last_score, last_id))
+    page = page.order_by(matches.c.score.desc(), matches.c.id.desc()).limit(limit + 1)
+
+    rows = db.execute(page).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_product, last_score = rows[-1]
+        next_cursor = encode_cursor(last_score, last_product.id)
+    return [(row[0], row[1]) for row in rows], next_cursor
@@ -0,0 +1,57 @@
+from functools import lru_cache
+from typing import Any, List, Sequence, Tuple, Type
+from pydantic import BaseModel
+from sqlalchemy import inspect, select
+from sqlalchemy.sql import Select
+
+from .fieldsets import nested_schema
+
+
+def schema_columns(model, schema: Type[BaseModel]) -> List[str]:
+    """Fields of schema that are plain columns of model, in schema order"""
+    column_attrs = inspect(model).column_attrs
+    return [name for name in schema.model_fields if name in column_attrs]
+
+
+class Projection:
+    """
+    The columns a response schema needs, read as plain rows instead of ORM instances.
+    There is no identity map, change tracking or relationship loading; rows() returns
+    plain dicts keyed by field name, which the response model validates as they are.
+    Related objects come from joined entities as prefixed columns and are folded back
+    into nested dicts, or None when the outer join found nothing.
+    """
+
+    def __init__(self, model, schema: Type[BaseModel], relations: Sequence[Tuple[str, Any]] = ()):
+        self.fields = schema_columns(model, schema)
+        self.columns = [getattr(model, name).label(name) for name in self.fields]
+        self.nested = []
+        for name, entity in relations:
+            fields = schema_columns(entity, nested_schema(schema.model_fields[name].annotation))
+            labels = [f"{name}__{field}" for field in fields]
+            self.columns.extend(getattr(entity, field).label(label) for field, label in zip(fields, labels))
+            # The primary key tells a missing related row apart from one with null columns
+            primary_key = inspect(entity).mapper.primary_key[0].key
+            marker = f"{name}__{primary_key}"
+            if marker not in labels:
+                self.columns.append(getattr(entity, primary_key).label(marker))
+            self.nested.append((name, list(zip(fields, labels)), marker))
+
+    def select(self) -> Select:
+        return select(*self.columns)
+
+    def rows(self, result) -> list:
+        if not self.nested:
+            return [row._asdict() for row in result]
+        rows = []
+        for row in result.mappings():
+            item = {field: row[field] for field in self.fields}
+            for name, pairs, marker in self.nested:
+                item[name] = {field: row[label] for field, label in pairs} if row[marker] is not None else None
+            rows.append(item)
+        return rows
+
+
+@lru_cache(maxsize=None)
+def projection(model, schema: Type[BaseModel], relations: Tuple[Tuple[str, Any], ...] = ()) -> Projection:
+    return Projection(model, schema, relations)
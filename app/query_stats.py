@@ -0,0 +1,125 @@
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are written to the log
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+# How many distinct fingerprints to keep before evicting the cheapest ones
+QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", "500"))
+
+# Route template of the request currently being served, set by middleware in main.py
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_BIND_PARAM = re.compile(r"%\([^)]+\)s|%s|\?|(?<!:):\w+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Normalize a SQL statement so that queries differing only in parameters group together"""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _BIND_PARAM.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    # IN lists of any length collapse into a single placeholder
+    normalized = _VALUE_LIST.sub("(?)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+@dataclass
+class QueryStat:
+    fingerprint: str
+    calls: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    slow_calls: int = 0
+    routes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+
+class QueryStatsRegistry:
+    """Thread-safe aggregation of statement timings keyed by fingerprint"""
+
+    def __init__(self, max_fingerprints: int = QUERY_STATS_MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self._stats: Dict[str, QueryStat] = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed_ms: float, route: Optional[str]) -> str:
+        key = fingerprint(statement)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    self._evict()
+                stat = self._stats[key] = QueryStat(fingerprint=key)
+            stat.calls += 1
+            stat.total_ms += elapsed_ms
+            stat.max_ms = max(stat.max_ms, elapsed_ms)
+            if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+                stat.slow_calls += 1
+            route_key = route or "<background>"
+            stat.routes[route_key] = stat.routes.get(route_key, 0) + 1
+        return key
+
+    def _evict(self) -> None:
+        # Drop the cheapest tenth so eviction is not paid on every new fingerprint
+        victims = sorted(self._stats.values(), key=lambda s: s.total_ms)
+        for stat in victims[:max(1, len(victims) // 10)]:
+            del self._stats[stat.fingerprint]
+
+    def top(self, limit: int = 20) -> List[QueryStat]:
+        with self._lock:
+            stats = list(self._stats.values())
+        return sorted(stats, key=lambda s: s.total_ms, reverse=True)[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+registry = QueryStatsRegistry()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attach timing hooks to every statement executed through the engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        route = current_route.get()
+        key = registry.record(statement, elapsed_ms, route)
+        if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+            logger.warning(
+                "Slow query (%.1f ms) on %s: %s",
+                elapsed_ms,
+                route or "<background>",
+                key,
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        # after_cursor_execute never fires for failed statements
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from alembic import command
 from alembic.config import Config
 from pathlib import Path
+from typing import List
 import os
 
+from .. import schemas, auth
+from ..query_stats import registry
+from ..tasks import task_queue
+from .. import load_shedding
+
 router = APIRouter(
     prefix="/admin",
     tags=["admin"]
@@ -28,3 +34,38 @@ async def run_migrations():
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Migration failed: {str(e)}"
         )
+
+@router.get(
+    "/query-stats",
+    response_model=List[schemas.QueryStat],
+    dependencies=[Depends(auth.verify_admin_token)]
+)
+def get_query_stats(limit: int = 20):
+    """Get the statement fingerprints with the highest total execution time"""
+    return registry.top(limit)
+
+@router.delete("/query-stats", dependencies=[Depends(auth.verify_admin_token)])
+def reset_query_stats():
+    """Clear collected statement timings"""
+    registry.reset()
+    return {"status": "success"}
+
+@router.get(
+    "/tasks",
+    response_model=schemas.TaskQueueStats,
+    dependencies=[Depends(auth.verify_admin_token)]
+)
+def get_task_queue_stats():
+    """Get queue depth, outcome counters and latency of deferred tasks"""
+    return {
+        "durable": task_queue.durable,
+        "workers": task_queue.workers,
+        "capacity": task_queue.capacity,
+        "depth": task_queue.depth(),
+        **task_queue.metrics.snapshot()
+    }
+
+@router.get("/load", dependencies=[Depends(auth.verify_admin_token)])
+def get_load():
+    """Get in-flight requests, waiters and shed counts of the load shedding middleware"""
+    return [limiter.snapshot() for limiter in load_shedding.limiters]
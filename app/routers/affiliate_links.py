@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from typing import List
 import secrets
 
 from .. import models, schemas, auth
-from ..database import get_db
+from ..database import get_db, get_read_db
+from ..fieldsets import FieldSet, selectable
+from ..click_log import click_writer, event_from_request, SOURCE_LINK_RESOLVE
 
 router = APIRouter(
     prefix="/affiliate-links",
@@ -72,12 +74,23 @@ def create_affiliate_link(
     return db_link
 
 @router.get("/{code}", response_model=schemas.AffiliateLinkDetail)
-def get_affiliate_link(code: str, db: Session = Depends(get_db)):
+def get_affiliate_link(
+    code: str,
+    request: Request,
+    fields: FieldSet | None = Depends(selectable(schemas.AffiliateLinkDetail)),
+    db: Session = Depends(get_read_db)
+):
     """Get affiliate link details by code"""
     # Get affiliate link with related product and blogger details
-    link = db.query(models.AffiliateLink)\
-        .filter(models.AffiliateLink.code == code)\
-        .first()
+    query = db.query(models.AffiliateLink).filter(models.AffiliateLink.code == code)
+    if fields:
+        # The click log needs the product and blogger ids whatever was selected
+        query = query.options(*fields.load_options(
+            models.AffiliateLink,
+            models.AffiliateLink.product_id,
+            models.AffiliateLink.blogger_id
+        ))
+    link = query.first()
     
     if not link:
         raise HTTPException(
@@ -85,4 +98,7 @@ def get_affiliate_link(code: str, db: Session = Depends(get_db)):
             detail="Affiliate link not found"
         )
     
+    click_writer.submit(event_from_request(request, SOURCE_LINK_RESOLVE, link.product_id, link.blogger_id, code))
+    if fields:
+        return fields.render(link)
     return link
\ No newline at end of file
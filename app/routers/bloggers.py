@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import date
+from typing import List, Optional
 
-from .. import models, schemas
-from ..database import get_db
+from .. import models, schemas, auth, blogger_earnings
+from ..database import get_db, get_read_db
+from ..projections import projection
 
 router = APIRouter(
     prefix="/bloggers",
@@ -35,8 +37,42 @@ def create_blogger(
 def get_bloggers(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all bloggers"""
-    bloggers = db.query(models.Blogger).offset(skip).limit(limit).all()
-    return bloggers
+    rows = projection(models.Blogger, schemas.Blogger)
+    return rows.rows(db.execute(rows.select().offset(skip).limit(limit)))
+
+@router.get("/{blogger_id}/earnings", response_model=schemas.BloggerEarnings)
+def get_blogger_earnings(
+    blogger_id: int,
+    shop_id: Optional[int] = None,
+    start_month: Optional[date] = None,
+    end_month: Optional[date] = None,
+    scope: Optional[int] = Depends(auth.get_shop_scope),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get a blogger's earnings by shop and month, newest first.
+    Shops see what the blogger earned with them; the admin token shows every shop.
+    """
+    if scope is not None:
+        if shop_id is not None and shop_id != scope:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to access this shop's earnings"
+            )
+        shop_id = scope
+    
+    blogger = db.query(models.Blogger.id).filter(models.Blogger.id == blogger_id).first()
+    if not blogger:
+        raise HTTPException(status_code=404, detail="Blogger not found")
+    
+    periods = blogger_earnings.blogger_earnings(db, blogger_id, shop_id, start_month, end_month)
+    return {
+        "blogger_id": blogger_id,
+        "order_count": sum(period["order_count"] for period in periods),
+        "items_sold": sum(period["items_sold"] for period in periods),
+        "money_earned": sum(period["money_earned"] for period in periods),
+        "periods": periods
+    }
@@ -1,52 +1,130 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response, Request, Query
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
-import shutil
-import os
-from pathlib import Path
+from datetime import date
 import mimetypes
 
 from .. import models, schemas, auth
-from ..database import get_db
+from ..batching import InvalidBatch, in_request_order, parse_ids
+from ..database import get_db, get_read_db
+from ..fieldsets import FieldSet, selectable
+from ..projections import projection
+from ..image_storage import CONTENT_KEY, IMAGE_URL_PREFIX, InvalidImageKey, image_storage
+from ..click_log import click_writer, event_from_request, SOURCE_PRODUCT_VIEW
+from ..product_search import InvalidSearch, SEARCH_MAX_LIMIT, search_products
+from ..tasks import task_queue
+from ..unique_visitors import visitor_fingerprint, resolve_window, count_unique_visitors_by_blogger
 
 router = APIRouter(
     prefix="/products",
     tags=["products"]
 )
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("uploads/products")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
 @router.get("/", response_model=List[schemas.Product])
 def get_products(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    fields: FieldSet | None = Depends(selectable(schemas.Product)),
+    db: Session = Depends(get_read_db),
     current_shop: models.Shop = Depends(auth.get_current_shop)
 ):
     """Get all products for the current shop"""
-    products = db.query(models.Product)\
-        .filter(models.Product.shop_id == current_shop.id)\
+    if fields:
+        query = db.query(models.Product)\
+            .filter(models.Product.shop_id == current_shop.id)\
+            .options(*fields.load_options(models.Product))\
+            .offset(skip)\
+            .limit(limit)
+        return fields.render(query.all())
+    
+    # Plain rows straight into the response model; no ORM instances to build and discard
+    rows = projection(models.Product, schemas.Product)
+    stmt = rows.select()\
+        .where(models.Product.shop_id == current_shop.id)\
         .offset(skip)\
-        .limit(limit)\
-        .all()
-    return products
+        .limit(limit)
+    return rows.rows(db.execute(stmt))
+
+@router.get("/search", response_model=schemas.ProductSearchPage)
+def search(
+    q: str = Query(..., min_length=2, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: str | None = None,
+    shop_id: int | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Search products by name and description, ranked by relevance.
+    Tolerates typos and matches word prefixes. Pass next_cursor back as cursor for the next page.
+    """
+    try:
+        hits, next_cursor = search_products(db, q, limit, cursor, shop_id, min_price, max_price)
+    except InvalidSearch as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return {
+        "items": [
+            {**schemas.Product.model_validate(product).model_dump(), "score": score}
+            for product, score in hits
+        ],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/batch", response_model=schemas.ProductBatch)
+def get_products_batch(
+    ids: List[str] = Query(..., description="Product ids, comma-separated or repeated"),
+    fields: FieldSet | None = Depends(selectable(schemas.Product)),
+    db: Session = Depends(get_read_db),
+    current_shop: models.Shop = Depends(auth.get_current_shop)
+):
+    """
+    Get many of the current shop's products in one query, in the order they were requested.
+    Ids that do not exist or belong to another shop are listed in missing. Unlike
+    GET /products/{id}, no visits are recorded, so pages can use it to render product lists.
+    """
+    try:
+        product_ids = parse_ids(ids)
+    except InvalidBatch as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    query = db.query(models.Product)\
+        .filter(models.Product.id.in_(product_ids), models.Product.shop_id == current_shop.id)
+    if fields:
+        query = query.options(*fields.load_options(models.Product, models.Product.id))
+    products = query.all()
+    
+    items, missing = in_request_order(product_ids, {product.id: product for product in products})
+    if fields:
+        return JSONResponse({"items": [fields.dump(item) for item in items], "missing": missing})
+    return {"items": items, "missing": missing}
 
 @router.get("/{product_id}", response_model=schemas.Product)
 def get_product(
     product_id: int,
+    request: Request,
     blogger_id: int | None = None,
+    fields: FieldSet | None = Depends(selectable(schemas.Product)),
     db: Session = Depends(get_db)
 ):
     """
     Get a single product by ID.
-    If blogger_id is provided, it will record the visit in analytics.
+    If blogger_id is provided, it will record the visit in analytics
+    and in the unique visitor sketch for the day.
     """
-    product = db.query(models.Product)\
-        .filter(models.Product.id == product_id)\
-        .first()
+    query = db.query(models.Product).filter(models.Product.id == product_id)
+    if fields:
+        query = query.options(*fields.load_options(models.Product))
+    product = query.first()
     
     if not product:
         raise HTTPException(
@@ -56,30 +134,23 @@ def get_product(
 
     # Record visit in analytics if blogger_id is provided
     if blogger_id:
-        analytics = db.query(models.Analytics)\
-            .filter(
-                models.Analytics.product_id == product_id,
-                models.Analytics.blogger_id == blogger_id
-            ).first()
-        
-        if analytics:
-            analytics.visit_count += 1
-        else:
-            analytics = models.Analytics(
-                product_id=product_id,
-                blogger_id=blogger_id,
-                visit_count=1
-            )
-            db.add(analytics)
-        
-        db.commit()
+        task_queue.defer(
+            "record_visit",
+            product_id=product_id,
+            blogger_id=blogger_id,
+            fingerprint=visitor_fingerprint(request)
+        )
 
+    click_writer.submit(event_from_request(request, SOURCE_PRODUCT_VIEW, product_id, blogger_id))
+    if fields:
+        return fields.render(product)
     return product
 
 @router.get("/{product_id}/analytics", response_model=List[schemas.Analytics])
 def get_product_analytics(
     product_id: int,
-    db: Session = Depends(get_db),
+    fields: FieldSet | None = Depends(selectable(schemas.Analytics)),
+    db: Session = Depends(get_read_db),
     current_shop: models.Shop = Depends(auth.get_current_shop)
 ):
     """Get analytics for a product with blogger details"""
@@ -97,12 +168,51 @@ def get_product_analytics(
         )
     
     # Query analytics with joined blogger details
-    analytics = db.query(models.Analytics)\
+    query = db.query(models.Analytics)\
         .join(models.Blogger)\
-        .filter(models.Analytics.product_id == product_id)\
-        .all()
+        .filter(models.Analytics.product_id == product_id)
+    if fields:
+        return fields.render(query.options(*fields.load_options(models.Analytics)).all())
+    return query.all()
+
+@router.get("/{product_id}/unique-visitors", response_model=schemas.ProductUniqueVisitors)
+def get_product_unique_visitors(
+    product_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    db: Session = Depends(get_read_db),
+    current_shop: models.Shop = Depends(auth.get_current_shop)
+):
+    """Get approximate unique visitors for a product, overall and per blogger"""
+    product = db.query(models.Product)\
+        .filter(
+            models.Product.id == product_id,
+            models.Product.shop_id == current_shop.id
+        ).first()
     
-    return analytics
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    
+    start_date, end_date = resolve_window(start_date, end_date)
+    total, per_blogger = count_unique_visitors_by_blogger(
+        db,
+        models.VisitorSketch.product_id == product_id,
+        models.VisitorSketch.day.between(start_date, end_date)
+    )
+    
+    return {
+        "product_id": product_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "unique_visitors": total,
+        "bloggers": [
+            {"blogger_id": blogger_id, "unique_visitors": count}
+            for blogger_id, count in sorted(per_blogger.items())
+        ]
+    }
 
 @router.post("/upload-image")
 async def upload_product_image(
@@ -117,14 +227,10 @@ async def upload_product_image(
             detail="File must be an image"
         )
     
-    # Create unique filename using shop ID and original filename
-    filename = f"{current_shop.id}_{image.filename}"
-    file_path = UPLOAD_DIR / filename
-    
-    # Save the file
+    # Store the file under the hash of its content, off the event loop;
+    # identical uploads from any shop share one stored copy
     try:
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        key = await run_in_threadpool(image_storage.save, image.file, image.filename, image.content_type)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -132,28 +238,37 @@ async def upload_product_image(
         )
     
     # Return the URL path to the image
-    return {"image_url": f"/products/images/{filename}"}
+    return {"image_url": f"{IMAGE_URL_PREFIX}{key}"}
 
-@router.get("/images/{filename}")
-async def get_product_image(filename: str):
-    """Get a product image by filename"""
-    file_path = UPLOAD_DIR / filename
+@router.get("/images/{key:path}")
+async def get_product_image(key: str):
+    """Get a product image by its storage key"""
+    try:
+        url = image_storage.url(key)
+        file_path = image_storage.local_path(key)
+    except InvalidImageKey:
+        url, file_path = None, None
     
-    if not file_path.exists():
+    if url:
+        return RedirectResponse(url)
+    if file_path is None or not file_path.is_file():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
     
     # Determine content type
-    content_type, _ = mimetypes.guess_type(filename)
+    content_type, _ = mimetypes.guess_type(file_path.name)
     if not content_type:
         content_type = "application/octet-stream"
     
+    # Content-addressed files never change, so clients may cache them for good
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"} if CONTENT_KEY.match(key) else None
     return FileResponse(
         path=file_path,
         media_type=content_type,
-        filename=filename
+        filename=file_path.name,
+        headers=headers
     )
 
 @router.post("/", response_model=schemas.Product)
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import date
 
-from .. import models, schemas, auth
-from ..database import get_db
+from .. import models, schemas, auth, leaderboard, live_analytics
+from ..database import get_db, get_read_db, open_read_session
+from ..fieldsets import FieldSet, selectable
+from ..projections import projection
+from ..order_export import ExportFormat, MEDIA_TYPES, shop_orders_query, stream_orders
+from ..unique_visitors import resolve_window, count_unique_visitors
 
 router = APIRouter(
     prefix="/shops",
@@ -71,8 +77,9 @@ def read_shop_me(
 @router.get("/{shop_id}/analytics", response_model=List[schemas.Analytics])
 def get_shop_analytics(
     shop_id: int,
+    fields: FieldSet | None = Depends(selectable(schemas.Analytics)),
     current_shop: models.Shop = Depends(auth.get_current_shop),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all analytics for a shop"""
     # Check if the user is trying to access their own shop
@@ -82,13 +89,132 @@ def get_shop_analytics(
             detail="Not authorized to access this shop's analytics"
         )
     
-    # Get all products for this shop
-    products = db.query(models.Product).filter(models.Product.shop_id == shop_id).all()
-    product_ids = [p.id for p in products]
+    # Analytics of all products of this shop
+    shop_products = db.query(models.Product.id)\
+        .filter(models.Product.shop_id == shop_id)\
+        .scalar_subquery()
+    if fields:
+        query = db.query(models.Analytics)\
+            .filter(models.Analytics.product_id.in_(shop_products))\
+            .options(*fields.load_options(models.Analytics))
+        return fields.render(query.all())
+    
+    # Plain rows with the blogger joined in, instead of one lazy load per analytics row
+    rows = projection(models.Analytics, schemas.Analytics, (("blogger", models.Blogger),))
+    stmt = rows.select()\
+        .outerjoin(models.Blogger, models.Analytics.blogger_id == models.Blogger.id)\
+        .where(models.Analytics.product_id.in_(shop_products))
+    return rows.rows(db.execute(stmt))
+
+@router.get("/{shop_id}/analytics/stream")
+async def stream_shop_analytics(
+    shop_id: int,
+    product_id: Optional[int] = None,
+    grant: auth.StreamGrant = Depends(auth.get_stream_grant)
+):
+    """
+    Push analytics deltas for the shop's products as Server-Sent Events.
+    Each delta event carries visit_count, order_count, items_sold and money_earned
+    increments for one (product, blogger) pair. A resync event means some were
+    dropped and totals should be reloaded from /analytics. The stream ends with an
+    expired event when the token expires; reconnect with a fresh token.
+    The token may be passed as ?access_token= since EventSource cannot set headers.
+    """
+    if grant.shop_id != shop_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this shop's analytics"
+        )
+    
+    return StreamingResponse(
+        live_analytics.event_stream(shop_id, product_id, grant.expires_at),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/{shop_id}/unique-visitors", response_model=schemas.ShopUniqueVisitors)
+def get_shop_unique_visitors(
+    shop_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    current_shop: models.Shop = Depends(auth.get_current_shop),
+    db: Session = Depends(get_read_db)
+):
+    """Get approximate unique reach across all products and bloggers of a shop"""
+    if current_shop.id != shop_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this shop's analytics"
+        )
+    
+    start_date, end_date = resolve_window(start_date, end_date)
+    shop_products = db.query(models.Product.id).filter(models.Product.shop_id == shop_id)
+    unique_visitors = count_unique_visitors(
+        db,
+        models.VisitorSketch.product_id.in_(shop_products.scalar_subquery()),
+        models.VisitorSketch.day.between(start_date, end_date)
+    )
+    
+    return {
+        "shop_id": shop_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "unique_visitors": unique_visitors
+    }
+
+@router.get("/{shop_id}/orders/export")
+def export_shop_orders(
+    shop_id: int,
+    request: Request,
+    format: ExportFormat = ExportFormat.NDJSON,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    order_status: models.OrderStatus | None = None,
+    current_shop: models.Shop = Depends(auth.get_current_shop)
+):
+    """
+    Stream all orders of a shop as NDJSON or CSV.
+    Rows are read through a server-side cursor, so memory use does not grow with the export.
+    """
+    if current_shop.id != shop_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this shop's orders"
+        )
     
-    # Get analytics for all products
-    analytics = db.query(models.Analytics)\
-        .filter(models.Analytics.product_id.in_(product_ids))\
-        .all()
+    query = shop_orders_query(shop_id, start_date, end_date, order_status)
+    return StreamingResponse(
+        stream_orders(lambda: open_read_session(request), query, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="shop-{shop_id}-orders.{format.value}"'}
+    )
+
+@router.get("/{shop_id}/leaderboard", response_model=List[schemas.LeaderboardEntry])
+def get_shop_leaderboard(
+    shop_id: int,
+    metric: leaderboard.LeaderboardMetric = leaderboard.LeaderboardMetric.REVENUE,
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_MAX_LIMIT),
+    min_visits: int = Query(0, ge=0),
+    current_shop: models.Shop = Depends(auth.get_current_shop),
+    db: Session = Depends(get_read_db)
+):
+    """Get the shop's top bloggers by revenue, orders or conversion rate"""
+    if current_shop.id != shop_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this shop's analytics"
+        )
     
-    return analytics
+    entries = leaderboard.top_bloggers(db, shop_id, metric, limit, min_visits)
+    return [
+        {
+            "blogger_id": entry.blogger_id,
+            "blogger_name": entry.blogger.name if entry.blogger else None,
+            "visit_count": entry.visit_count,
+            "order_count": entry.order_count,
+            "items_sold": entry.items_sold,
+            "money_earned": entry.money_earned,
+            "conversion_rate": entry.order_count / entry.visit_count if entry.visit_count else None
+        }
+        for entry in entries
+    ]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Dict
+from datetime import datetime, date
 from .models import OrderStatus
 
 class ShopBase(BaseModel):
@@ -37,6 +37,13 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductSearchHit(Product):
+    score: float
+
+class ProductSearchPage(BaseModel):
+    items: List[ProductSearchHit]
+    next_cursor: Optional[str] = None
+
 class BloggerBase(BaseModel):
     name: str
     email: EmailStr
@@ -89,6 +96,61 @@ class Analytics(AnalyticsBase):
     class Config:
         from_attributes = True
 
+class ProductBatch(BaseModel):
+    items: List[Product]
+    missing: List[int]
+
+class ProductAnalytics(BaseModel):
+    product_id: int
+    analytics: List[Analytics]
+
+class AnalyticsBatch(BaseModel):
+    items: List[ProductAnalytics]
+    missing: List[int]
+
+class BloggerUniqueVisitors(BaseModel):
+    blogger_id: int
+    unique_visitors: int
+
+class ProductUniqueVisitors(BaseModel):
+    product_id: int
+    start_date: date
+    end_date: date
+    unique_visitors: int
+    bloggers: List[BloggerUniqueVisitors]
+
+class ShopUniqueVisitors(BaseModel):
+    shop_id: int
+    start_date: date
+    end_date: date
+    unique_visitors: int
+
+class LeaderboardEntry(BaseModel):
+    blogger_id: int
+    blogger_name: Optional[str] = None
+    visit_count: int
+    order_count: int
+    items_sold: int
+    money_earned: float
+    conversion_rate: Optional[float] = None
+
+class EarningsPeriod(BaseModel):
+    shop_id: int
+    month: date
+    order_count: int
+    items_sold: int
+    money_earned: float
+
+    class Config:
+        from_attributes = True
+
+class BloggerEarnings(BaseModel):
+    blogger_id: int
+    order_count: int
+    items_sold: int
+    money_earned: float
+    periods: List[EarningsPeriod]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -120,4 +182,30 @@ class AffiliateLinkDetail(AffiliateLink):
     blogger: Blogger
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class QueryStat(BaseModel):
+    fingerprint: str
+    calls: int
+    total_ms: float
+    mean_ms: float
+    max_ms: float
+    slow_calls: int
+    routes: Dict[str, int]
+
+    class Config:
+        from_attributes = True
+
+class TaskQueueStats(BaseModel):
+    durable: bool
+    workers: int
+    capacity: int
+    depth: int
+    submitted: int
+    completed: int
+    retried: int
+    failed: int
+    ran_inline: int
+    latency_avg_ms: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+    latency_max_ms: Optional[float] = None
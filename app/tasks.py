@@ -0,0 +1,288 @@
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict
+from sqlalchemy import delete, func, select, update
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from . import models
+from .database import BackgroundSessionLocal
+
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE_SIZE = int(os.getenv("TASK_QUEUE_SIZE", "1000"))
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "2"))
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", "3"))
+TASK_RETRY_BACKOFF_SECONDS = float(os.getenv("TASK_RETRY_BACKOFF_SECONDS", "0.5"))
+# Keep queued tasks in the deferred_tasks table so they survive restarts
+TASK_QUEUE_DURABLE = os.getenv("TASK_QUEUE_DURABLE", "false").lower() in ("1", "true", "yes")
+TASK_POLL_SECONDS = float(os.getenv("TASK_POLL_SECONDS", "1.0"))
+
+# Task functions by name; each is called as func(db, **kwargs) and its session is committed on success
+_registry: Dict[str, Callable] = {}
+
+
+def task(name: str):
+    """Register a function so it can be deferred by name"""
+    def decorator(func: Callable) -> Callable:
+        _registry[name] = func
+        return func
+    return decorator
+
+
+@dataclass
+class QueuedTask:
+    name: str
+    kwargs: dict
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class TaskMetrics:
+    """Counters and a rolling window of enqueue-to-finish latencies"""
+
+    def __init__(self, window: int = 1000):
+        self.submitted = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.spilled = 0
+        self._latencies_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe(self, latency_ms: float) -> None:
+        with self._lock:
+            self.completed += 1
+            self._latencies_ms.append(latency_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            counters = {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "spilled": self.spilled,
+            }
+        if latencies:
+            counters.update(
+                latency_avg_ms=sum(latencies) / len(latencies),
+                latency_p95_ms=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                latency_max_ms=latencies[-1],
+            )
+        return counters
+
+
+class TaskQueue:
+    """
+    Bounded in-process queue with a pool of worker threads for deferred side effects.
+    In durable mode tasks are stored in deferred_tasks and claimed with SKIP LOCKED,
+    so several workers and processes can share them and nothing is lost on restart.
+    """
+
+    def __init__(
+        self,
+        capacity: int = TASK_QUEUE_SIZE,
+        workers: int = TASK_WORKERS,
+        max_retries: int = TASK_MAX_RETRIES,
+        retry_backoff: float = TASK_RETRY_BACKOFF_SECONDS,
+        durable: bool = TASK_QUEUE_DURABLE
+    ):
+        self.capacity = capacity
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.durable = durable
+        self.metrics = TaskMetrics()
+        self._queue: "queue.Queue[QueuedTask]" = queue.Queue(maxsize=capacity)
+        self._wakeup = threading.Event()
+        # Set while tasks spilled from a full in-memory queue may be waiting in deferred_tasks
+        self._spilled = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def defer(self, name: str, **kwargs) -> None:
+        """
+        Schedule a registered task. kwargs must be JSON-serializable.
+        When the in-memory queue is full the task is stored in deferred_tasks for the
+        workers to pick up, so it is neither lost nor run in the caller's thread.
+        """
+        if name not in _registry:
+            raise KeyError(f"Unknown task: {name}")
+        self.metrics.count("submitted")
+        if self.durable:
+            self._store(name, kwargs)
+            self._wakeup.set()
+            return
+        try:
+            self._queue.put_nowait(QueuedTask(name, kwargs))
+        except queue.Full:
+            logger.warning("Task queue is full, spilling %s to deferred_tasks", name)
+            self.metrics.count("spilled")
+            self._store(name, kwargs)
+            self._spilled.set()
+
+    def depth(self) -> int:
+        if not self.durable:
+            return self._queue.qsize()
+        db = BackgroundSessionLocal()
+        try:
+            return db.query(func.count(models.DeferredTask.id))\
+                .filter(models.DeferredTask.status == "pending")\
+                .scalar()
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        target = self._durable_worker if self.durable else self._memory_worker
+        # Pick up tasks spilled before a restart
+        self._spilled.set()
+        for index in range(self.workers):
+            thread = threading.Thread(target=target, name=f"task-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the workers; in-memory tasks already queued are finished first"""
+        self._stop.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def _execute(self, name: str, kwargs: dict) -> None:
+        db = BackgroundSessionLocal()
+        try:
+            _registry[name](db, **kwargs)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # In-memory mode
+
+    def _memory_worker(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            if self._spilled.is_set():
+                self._run_spilled()
+            try:
+                queued = self._queue.get(timeout=TASK_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            self._run_with_retries(queued)
+
+    def _run_spilled(self) -> None:
+        """Run one spilled task, interleaved with the in-memory queue so neither starves"""
+        # Cleared first, so a task spilled while this one runs sets it again
+        self._spilled.clear()
+        try:
+            if self._claim_and_run():
+                self._spilled.set()
+        except Exception:
+            logger.exception("Task worker could not poll deferred_tasks")
+            self._spilled.set()
+
+    def _run_with_retries(self, queued: QueuedTask) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._execute(queued.name, queued.kwargs)
+            except Exception:
+                if attempt == self.max_retries:
+                    self.metrics.count("failed")
+                    logger.exception("Task %s failed after %d attempts", queued.name, attempt + 1)
+                    return
+                self.metrics.count("retried")
+                time.sleep(self.retry_backoff * 2 ** attempt)
+            else:
+                self.metrics.observe((time.monotonic() - queued.enqueued_at) * 1000)
+                return
+
+    # Durable mode
+
+    def _store(self, name: str, kwargs: dict) -> None:
+        db = BackgroundSessionLocal()
+        try:
+            db.add(models.DeferredTask(name=name, payload=json.dumps(kwargs)))
+            db.commit()
+        finally:
+            db.close()
+
+    def _durable_worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ran = self._claim_and_run()
+            except Exception:
+                logger.exception("Task worker could not poll deferred_tasks")
+                ran = False
+            if not ran:
+                self._wakeup.wait(TASK_POLL_SECONDS)
+                self._wakeup.clear()
+
+    def _claim_and_run(self) -> bool:
+        deferred = models.DeferredTask
+        db = BackgroundSessionLocal()
+        try:
+            row = db.execute(
+                select(deferred.id, deferred.name, deferred.payload, deferred.attempts, deferred.created_at)
+                .where(deferred.status == "pending", deferred.run_after <= func.now())
+                .order_by(deferred.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if row is None:
+                db.rollback()
+                return False
+            try:
+                # The task runs in a savepoint of the claiming transaction, so the row stays
+                # locked until either its deletion or its failure record is committed
+                with db.begin_nested():
+                    db.execute(delete(deferred).where(deferred.id == row.id))
+                    _registry[row.name](db, **json.loads(row.payload))
+            except Exception as e:
+                self._record_failure(db, row, e)
+                db.commit()
+                return True
+            db.commit()
+            latency = datetime.now(timezone.utc) - row.created_at
+            self.metrics.observe(latency.total_seconds() * 1000)
+            return True
+        finally:
+            db.close()
+
+    def _record_failure(self, db, row, error: Exception) -> None:
+        """Count a failed attempt and schedule the retry, in the transaction holding the row's lock"""
+        attempts = row.attempts + 1
+        exhausted = attempts > self.max_retries
+        if exhausted:
+            self.metrics.count("failed")
+            logger.error("Task %s (%s) failed after %d attempts: %r", row.name, row.id, attempts, error)
+        else:
+            self.metrics.count("retried")
+        db.execute(
+            update(models.DeferredTask)
+            .where(models.DeferredTask.id == row.id)
+            .values(
+                attempts=attempts,
+                last_error=repr(error)[:1000],
+                status="failed" if exhausted else "pending",
+                run_after=datetime.now(timezone.utc) + timedelta(seconds=self.retry_backoff * 2 ** row.attempts)
+            )
+        )
+
+
+task_queue = TaskQueue()
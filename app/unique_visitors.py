@@ -0,0 +1,83 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+from fastapi import Request
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import hashlib
+
+from . import models
+from .clients import client_address
+from .hll import HyperLogLog, REGISTER_COUNT, register_update
+
+DEFAULT_WINDOW_DAYS = 30
+
+
+def visitor_fingerprint(request: Request) -> str:
+    """Identify a visitor by a digest, so no address or user agent is kept even in queued tasks"""
+    identity = "|".join([
+        client_address(request),
+        request.headers.get("user-agent", ""),
+        request.headers.get("accept-language", ""),
+    ])
+    return hashlib.blake2b(identity.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def record_unique_visit(db: Session, product_id: int, blogger_id: int, fingerprint: str) -> None:
+    """
+    Add a visitor to today's sketch for the (product, blogger) pair.
+    Only the one register the visitor maps to is touched, atomically in SQL,
+    so concurrent visits never overwrite each other. The caller commits.
+    """
+    index, rank = register_update(fingerprint)
+    registers = bytearray(REGISTER_COUNT)
+    registers[index] = rank
+
+    sketch = models.VisitorSketch.__table__
+    stmt = insert(sketch).values(
+        product_id=product_id,
+        blogger_id=blogger_id,
+        day=datetime.utcnow().date(),
+        registers=bytes(registers),
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_visitor_sketches_product_blogger_day",
+        set_={
+            "registers": func.set_byte(
+                sketch.c.registers,
+                index,
+                func.greatest(func.get_byte(sketch.c.registers, index), rank),
+            ),
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def resolve_window(start_date: Optional[date], end_date: Optional[date]) -> Tuple[date, date]:
+    end_date = end_date or datetime.utcnow().date()
+    start_date = start_date or end_date - timedelta(days=DEFAULT_WINDOW_DAYS - 1)
+    return start_date, end_date
+
+
+def count_unique_visitors(db: Session, *criteria) -> int:
+    """Merge every sketch matching the criteria into one estimate"""
+    total = HyperLogLog()
+    rows = db.query(models.VisitorSketch.registers).filter(*criteria).yield_per(500)
+    for (registers,) in rows:
+        total.merge(HyperLogLog(registers))
+    return total.count()
+
+
+def count_unique_visitors_by_blogger(db: Session, *criteria) -> Tuple[int, Dict[int, int]]:
+    """Estimate unique visitors per blogger and across all of them"""
+    total = HyperLogLog()
+    per_blogger: Dict[int, HyperLogLog] = {}
+    rows = db.query(models.VisitorSketch.blogger_id, models.VisitorSketch.registers)\
+        .filter(*criteria)\
+        .yield_per(500)
+    for blogger_id, registers in rows:
+        sketch = HyperLogLog(registers)
+        per_blogger.setdefault(blogger_id, HyperLogLog()).merge(sketch)
+        total.merge(sketch)
+    return total.count(), {blogger_id: hll.count() for blogger_id, hll in per_blogger.items()}
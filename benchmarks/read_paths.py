@@ -0,0 +1,164 @@
+"""
+Compare the ORM and row projection read paths of the list endpoints.
+
+Seeds rows inside a transaction that is rolled back at the end, then reports per
+1,000 rows the CPU time of fetching alone, of fetching plus response validation
+and serialization, and the peak memory allocated along the way.
+
+Usage:
+    python -m benchmarks.read_paths [--rows 5000] [--repeat 5]
+"""
+from typing import Callable, List
+import argparse
+import time
+import tracemalloc
+import uuid
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.database import engine
+from app.projections import projection
+
+
+def seed(db: Session, rows: int) -> int:
+    tag = uuid.uuid4().hex[:8]
+    shop_id = db.execute(
+        insert(models.Shop).values(name=f"bench-{tag}", email=f"bench-{tag}@example.com", hashed_password="x")
+        .returning(models.Shop.id)
+    ).scalar_one()
+    db.execute(insert(models.Blogger), [
+        {"name": f"blogger {i}", "email": f"bench-{tag}-{i}@example.com", "bio": "x" * 200}
+        for i in range(rows)
+    ])
+    db.execute(insert(models.Product), [
+        {"shop_id": shop_id, "name": f"product {i}", "description": "y" * 200, "price": 10.0 + i}
+        for i in range(rows)
+    ])
+    product_ids = [id_ for (id_,) in db.query(models.Product.id).filter(models.Product.shop_id == shop_id)]
+    blogger_ids = [id_ for (id_,) in db.query(models.Blogger.id).filter(models.Blogger.email.like(f"bench-{tag}-%"))]
+    db.execute(insert(models.Order), [
+        {
+            "product_id": product_ids[0],
+            "blogger_id": blogger_ids[i % len(blogger_ids)],
+            "quantity": 1,
+            "price_per_item": 10.0,
+            "client_phone": "+70000000000",
+            "status": models.OrderStatus.WAITING,
+        }
+        for i in range(rows)
+    ])
+    db.execute(insert(models.Analytics), [
+        {
+            "product_id": product_ids[i],
+            "blogger_id": blogger_ids[i],
+            "visit_count": i,
+            "order_count": 1,
+            "items_sold": 1,
+            "money_earned": 10.0,
+        }
+        for i in range(rows)
+    ])
+    db.flush()
+    return shop_id
+
+
+def measure(db: Session, run: Callable[[], list], repeat: int) -> dict:
+    """CPU seconds and peak traced bytes of run(), starting from an empty session each time"""
+    run()
+    db.expunge_all()
+    started = time.process_time()
+    for _ in range(repeat):
+        count = len(run())
+        db.expunge_all()
+    cpu = (time.process_time() - started) / repeat
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.expunge_all()
+    return {"rows": count, "cpu": cpu, "peak": peak}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.read_paths")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection)
+    try:
+        shop_id = seed(db, args.rows)
+        product_id = db.query(models.Product.id).filter(models.Product.shop_id == shop_id).order_by(models.Product.id).first()[0]
+        shop_products = db.query(models.Product.id).filter(models.Product.shop_id == shop_id).scalar_subquery()
+
+        def serializer(schema) -> Callable[[list], list]:
+            adapter = TypeAdapter(List[schema])
+            return lambda items: adapter.dump_python(adapter.validate_python(items), mode="json")
+
+        product_rows = projection(models.Product, schemas.Product)
+        blogger_rows = projection(models.Blogger, schemas.Blogger)
+        order_rows = projection(models.Order, schemas.Order)
+        analytics_rows = projection(models.Analytics, schemas.Analytics, (("blogger", models.Blogger),))
+
+        # endpoint: (ORM fetch, projection fetch, response schema)
+        cases = {
+            "get_products": (
+                lambda: db.query(models.Product).filter(models.Product.shop_id == shop_id).all(),
+                lambda: product_rows.rows(db.execute(product_rows.select().where(models.Product.shop_id == shop_id))),
+                schemas.Product,
+            ),
+            "get_bloggers": (
+                lambda: db.query(models.Blogger).limit(args.rows).all(),
+                lambda: blogger_rows.rows(db.execute(blogger_rows.select().limit(args.rows))),
+                schemas.Blogger,
+            ),
+            "get_product_orders": (
+                lambda: db.query(models.Order).filter(models.Order.product_id == product_id).all(),
+                lambda: order_rows.rows(db.execute(order_rows.select().where(models.Order.product_id == product_id))),
+                schemas.Order,
+            ),
+            "get_shop_analytics": (
+                lambda: db.query(models.Analytics).filter(models.Analytics.product_id.in_(shop_products)).all(),
+                lambda: analytics_rows.rows(db.execute(
+                    analytics_rows.select()
+                    .outerjoin(models.Blogger, models.Analytics.blogger_id == models.Blogger.id)
+                    .where(models.Analytics.product_id.in_(shop_products))
+                )),
+                schemas.Analytics,
+            ),
+        }
+
+        # fetch: query and build rows or instances; total: also validate and serialize the response
+        print(f"{'endpoint':<20} {'path':<11} {'rows':>6} {'fetch ms/1k':>12} {'total ms/1k':>12} {'peak KiB/1k':>12}")
+        for name, (orm_fetch, row_fetch, schema) in cases.items():
+            serialize = serializer(schema)
+            results = {}
+            for path, fetch in (("orm", orm_fetch), ("projection", row_fetch)):
+                total = measure(db, lambda: serialize(fetch()), args.repeat)
+                total["fetch"] = measure(db, fetch, args.repeat)["cpu"]
+                results[path] = total
+                per_thousand = 1000 / max(total["rows"], 1)
+                print(
+                    f"{name:<20} {path:<11} {total['rows']:>6} {total['fetch'] * 1000 * per_thousand:>12.2f} "
+                    f"{total['cpu'] * 1000 * per_thousand:>12.2f} {total['peak'] / 1024 * per_thousand:>12.1f}"
+                )
+            orm, rows = results["orm"], results["projection"]
+            print(
+                f"{'':<20} {'saving':<11} {'':>6} {100 * (1 - rows['fetch'] / orm['fetch']):>11.0f}% "
+                f"{100 * (1 - rows['cpu'] / orm['cpu']):>11.0f}% {100 * (1 - rows['peak'] / orm['peak']):>11.0f}%"
+            )
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())